@@ -7,8 +7,10 @@ from flask_migrate import Migrate
 from flask_restful import Api
 from flask_uploads import configure_uploads, patch_request_class
 
+from commands import data_cli, cache_cli
 from config import Config
-from extensions import db, jwt, image_set, cache, limiter
+from extensions import db, jwt, image_set, cache, limiter, metrics, profiler, compression, media, unit_of_work
+from search import init_trigram_search
 
 from resources.user import (
     UserListResource, UserResource,
@@ -17,7 +19,7 @@ from resources.user import (
 )
 from resources.token import TokenResource, RefreshResource, RevokeResource, black_list
 from resources.recipe import (
-    RecipeListResource, RecipeResource,
+    RecipeListResource, RecipeResource, RecipeSuggestionResource, RecipeChangeListResource, RecipeStatsResource,
     RecipePublishResource, RecipeCoverUploadResource
 )
 
@@ -34,6 +36,8 @@ def create_app():
         config_str = 'config.ProductionConfig'
     elif env == 'Staging':
         config_str = 'config.StagingConfig'
+    elif env == 'Benchmark':
+        config_str = 'config.BenchmarkConfig'
     else:
         config_str = 'config.DevelopmentConfig'
 
@@ -42,6 +46,7 @@ def create_app():
 
     register_extensions(app)
     register_resources(app)
+    register_commands(app)
 
     return app
 
@@ -50,12 +55,24 @@ def register_extensions(app):
     """function to initialize extensions"""
     db.app = app
     db.init_app(app)
+
+    # The similarity cut-off of the trigram search is set once per database connection
+    if app.config['SEARCH_TRIGRAM_ENABLED']:
+        init_trigram_search(db.engine, app.config['SEARCH_SIMILARITY_THRESHOLD'])
     migrate.init_app(app, db)
     jwt.init_app(app)
     configure_uploads(app, image_set)
     patch_request_class(app, 10*1024*1024)
     cache.init_app(app)
     limiter.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    compression.init_app(app)
+    media.init_app(app)
+
+    # Registered last, its after_request hook runs first: the request is committed before
+    # the response is compressed and measured
+    unit_of_work.init_app(app)
 
     # check whether the token is on the blacklist
     @jwt.token_in_blacklist_loader
@@ -65,12 +82,21 @@ def register_extensions(app):
         return jti in black_list
 
 
+def register_commands(app):
+    """function to add the command line commands, next to the 'flask db' ones"""
+    app.cli.add_command(data_cli)
+    app.cli.add_command(cache_cli)
+
+
 def register_resources(app):
     """function to set up resource routing"""
     api = Api(app)
 
     api.add_resource(UserListResource, '/users')
     api.add_resource(RecipeListResource, '/recipes')
+    api.add_resource(RecipeSuggestionResource, '/recipes/suggestions')
+    api.add_resource(RecipeChangeListResource, '/recipes/changes')
+    api.add_resource(RecipeStatsResource, '/recipes/stats')
     api.add_resource(RecipeResource, '/recipes/<int:recipe_id>')
     api.add_resource(RecipePublishResource, '/recipes/<int:recipe_id>/publish')
     api.add_resource(UserResource, '/users/<string:username>')
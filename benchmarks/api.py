@@ -0,0 +1,280 @@
+# benchmarks/api.py file
+"""Load test of the RESTful endpoints.
+
+The app is built with create_app() using the Benchmark configuration, against a
+local database seeded with a configurable number of users and recipes. Every
+scenario is driven through the Flask test client, or over HTTP with a pool of
+threads when --url is given, and the p50/p95/p99 latency and the throughput are
+compared against a stored baseline.
+
+    ENV=Benchmark BENCHMARK_DATABASE_URL=postgresql+psycopg2://localhost/data_recipe_benchmark \\
+        python -m benchmarks.api --users 200 --recipes 5000 --requests 500 --save-baseline
+"""
+
+# Import the necessary package and module
+import argparse
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_migrate import upgrade
+
+os.environ.setdefault('ENV', 'Benchmark')
+
+from app import create_app
+from datagen import INGREDIENTS, generate
+from extensions import db, cache
+from models.recipe import Recipe
+from models.user import User
+from utils import hash_password
+
+# Password of every seeded user
+PASSWORD = 'benchmark-password'
+
+# Words used to build the search queries
+WORDS = INGREDIENTS[:30]
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def seed(app, users, recipes, seed=None):
+    """Function to fill an empty database with users and recipes"""
+    with app.app_context():
+        if User.query.first():
+            return
+
+        generate(users=users, recipes=recipes, password=hash_password(PASSWORD), seed=seed, echo=lambda line: None)
+
+        # Every benchmark user must be able to log in
+        User.query.update({'is_active': True})
+        db.session.commit()
+
+
+def percentile(values, p):
+    """Function to get the nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def make_image():
+    """Function to build the JPEG file sent to the upload endpoints"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (1600, 1200), (180, 120, 60)).save(buffer, 'JPEG', quality=90)
+
+    return buffer.getvalue()
+
+
+class TestClientDriver:
+    """Send the requests in process through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def __call__(self, method, path, **kwargs):
+        return self.client.open(path, method=method, **kwargs).status_code
+
+    def login(self, email):
+        """This method returns the access token of a seeded user"""
+        return self.client.post('/token', json={'email': email, 'password': PASSWORD}).get_json()['access_token']
+
+
+class HttpDriver:
+    """Send the requests to a running server"""
+
+    def __init__(self, url):
+        import requests
+
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def __call__(self, method, path, json=None, data=None, headers=None, content_type=None):
+        files = None
+
+        if data is not None:
+            files = {name: (filename, stream.getvalue()) for name, (stream, filename) in data.items()}
+
+        return self.session.request(method, self.url + path, json=json, files=files, headers=headers).status_code
+
+    def login(self, email):
+        """This method returns the access token of a seeded user"""
+        return self.session.post(
+            self.url + '/token', json={'email': email, 'password': PASSWORD}).json()['access_token']
+
+
+def build_scenarios(app, driver, image):
+    """Function to build the list of (name, request factory) pairs"""
+    with app.app_context():
+        users = User.query.order_by(User.id).limit(10).all()
+        published = [row.id for row in db.session.query(Recipe.id).filter_by(is_publish=True).limit(1000)]
+        owned = {user.id: [row.id for row in db.session.query(Recipe.id).filter_by(user_id=user.id).limit(20)]
+                 for user in users}
+
+    tokens = {user.id: {'Authorization': 'Bearer {}'.format(driver.login(user.email))} for user in users}
+    owners = [user for user in users if owned[user.id]]
+
+    def search():
+        return 'GET', '/recipes?q={}&page={}'.format(random.choice(WORDS)[:5], random.randint(1, 3)), {}
+
+    def sort_page():
+        return 'GET', '/recipes?sort={}&order={}&page={}'.format(
+            random.choice(['created_at', 'cook_time', 'num_of_servings']),
+            random.choice(['asc', 'desc']), random.randint(1, 20)), {}
+
+    def detail():
+        return 'GET', '/recipes/{}'.format(random.choice(published)), {}
+
+    def token():
+        user = random.choice(users)
+        return 'POST', '/token', {'json': {'email': user.email, 'password': PASSWORD}}
+
+    def cover_upload():
+        user = random.choice(owners)
+        return 'PUT', '/recipes/{}/cover'.format(random.choice(owned[user.id])), {
+            'headers': tokens[user.id], 'content_type': 'multipart/form-data',
+            'data': {'cover': (io.BytesIO(image), 'cover.jpg')}}
+
+    def avatar_upload():
+        user = random.choice(users)
+        return 'PUT', '/users/avatar', {
+            'headers': tokens[user.id], 'content_type': 'multipart/form-data',
+            'data': {'avatar': (io.BytesIO(image), 'avatar.jpg')}}
+
+    return [
+        ('recipes_search', search),
+        ('recipes_sort_page', sort_page),
+        ('recipe_detail', detail),
+        ('token', token),
+        ('cover_upload', cover_upload),
+        ('avatar_upload', avatar_upload),
+    ]
+
+
+def run_scenario(driver, factory, requests, concurrency):
+    """Function to run a scenario and return its latency percentiles and throughput"""
+    def one(_):
+        method, path, kwargs = factory()
+        start = time.perf_counter()
+        status = driver(method, path, **kwargs)
+
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(one, range(requests)))
+    else:
+        results = [one(i) for i in range(requests)]
+
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status >= 400),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput_rps': round(requests / elapsed, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Function to print the change against the baseline and return the regressed scenarios"""
+    regressions = []
+
+    for name, result in results.items():
+        previous = baseline.get(name)
+
+        if not previous:
+            continue
+
+        # A baseline with a zero latency or throughput, e.g. of a failed run, has nothing to compare with
+        if not previous['p95_ms'] or not previous['throughput_rps']:
+            print('{:<20} no baseline'.format(name))
+            continue
+
+        p95_change = (result['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+        rps_change = (result['throughput_rps'] - previous['throughput_rps']) / previous['throughput_rps'] * 100
+
+        print('{:<20} p95 {:+7.1f}%   throughput {:+7.1f}%'.format(name, p95_change, rps_change))
+
+        if p95_change > tolerance or rps_change < -tolerance:
+            regressions.append(name)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='users seeded in an empty database')
+    parser.add_argument('--recipes', type=int, default=2000, help='recipes seeded in an empty database')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent clients')
+    parser.add_argument('--scenario', action='append', help='run only the given scenarios')
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--no-cache', action='store_true', help='disable the response cache')
+    parser.add_argument('--seed', type=int, default=2020, help='random seed')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+
+    app = create_app()
+
+    if args.no_cache:
+        app.config['CACHE_TYPE'] = 'null'
+        cache.init_app(app)
+
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_PATH)
+
+    seed(app, args.users, args.recipes, seed=args.seed)
+
+    driver = HttpDriver(args.url) if args.url else TestClientDriver(app)
+    results = {}
+
+    for name, factory in build_scenarios(app, driver, make_image()):
+        if args.scenario and name not in args.scenario:
+            continue
+
+        with app.app_context():
+            cache.clear()
+
+        results[name] = run_scenario(driver, factory, args.requests, args.concurrency)
+        result = results[name]
+
+        print('{:<20} p50 {:>9.2f} ms  p95 {:>9.2f} ms  p99 {:>9.2f} ms  {:>9.2f} req/s  {} errors'.format(
+            name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['throughput_rps'], result['errors']))
+
+    regressions = []
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print('Regressions over {}%: {}'.format(args.tolerance, ', '.join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
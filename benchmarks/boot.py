@@ -0,0 +1,77 @@
+# benchmarks/boot.py file
+"""Import-time profile of create_app().
+
+Runs 'from app import create_app; create_app()' in a fresh interpreter with
+'python -X importtime', then prints the slowest modules and the wall time of
+the import and of create_app(), which is what every Gunicorn worker pays on
+boot when the app is not preloaded.
+
+    python -m benchmarks.boot --top 25
+"""
+
+# Import the necessary package and module
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code run in the child interpreter, it prints the timings on the last line of stdout
+BOOT = '''
+import time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+print(imported - start, time.perf_counter() - imported)
+'''
+
+
+def parse_importtime(stderr):
+    """Function to parse the '-X importtime' report into (module, self us, cumulative us) tuples"""
+    modules = []
+
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    return modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=20, help='number of modules to show')
+    parser.add_argument('--cumulative', action='store_true', help='sort by cumulative instead of self time')
+    args = parser.parse_args(argv)
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if result.returncode:
+        sys.stderr.write(result.stderr)
+        return result.returncode
+
+    import_seconds, create_app_seconds = (float(value) for value in result.stdout.split()[-2:])
+    modules = parse_importtime(result.stderr)
+    modules.sort(key=lambda module: module[2] if args.cumulative else module[1], reverse=True)
+
+    print('{:<50} {:>12} {:>12}'.format('module', 'self ms', 'cumul. ms'))
+
+    for name, self_us, cumulative_us in modules[:args.top]:
+        print('{:<50} {:>12.1f} {:>12.1f}'.format(name, self_us / 1000, cumulative_us / 1000))
+
+    print()
+    print('{} modules imported'.format(len(modules)))
+    print('import app:   {:8.1f} ms'.format(import_seconds * 1000))
+    print('create_app(): {:8.1f} ms'.format(create_app_seconds * 1000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# benchmarks/compression.py file
+"""CPU cost and bytes saved by the compression levels of compression.py.
+
+Builds recipe list pages like the ones of GET /recipes from synthetic recipes
+of datagen.py, serialized the way Flask-RESTful does, and times their
+compression with gzip at levels 1, 6 and 9 and with brotli at qualities 1, 4
+and 11 (when the 'brotli' package is installed).
+
+    python -m benchmarks.compression --pages 50 --per-page 20
+"""
+
+# Import the necessary package and module
+import argparse
+import json
+import statistics
+import sys
+import time
+import uuid
+
+from compression import brotli_module, compress
+from datagen import RecipeGenerator
+
+LEVELS = (('gzip', 1), ('gzip', 6), ('gzip', 9), ('br', 1), ('br', 4), ('br', 11))
+
+
+def recipe_page(generator, page, per_page):
+    """Function to build the JSON body of a page of the recipe list"""
+    data = []
+
+    for number in range(per_page):
+        recipe_id = (page - 1) * per_page + number + 1
+        row = generator.recipe_row(user_id=generator.rng.randint(1, 10000))
+        data.append({
+            'id': recipe_id,
+            'name': row['name'],
+            'description': row['description'],
+            'num_of_servings': row['num_of_servings'],
+            'cook_time': row['cook_time'],
+            'ingredients': row['ingredients'],
+            'directions': row['directions'],
+            'cover_url': 'http://localhost:5000/media/recipes/{}.jpg'.format(
+                uuid.UUID(int=generator.rng.getrandbits(128), version=4)),
+            'is_publish': True,
+            'author': {'id': row['user_id'], 'username': 'user{}'.format(row['user_id']),
+                       'created_at': row['created_at'].isoformat(), 'updated_at': row['created_at'].isoformat()},
+            'created_at': row['created_at'].isoformat(),
+            'updated_at': row['updated_at'].isoformat(),
+        })
+
+    body = {
+        'links': {'first': 'http://localhost:5000/recipes?page=1&per_page={}'.format(per_page),
+                  'last': 'http://localhost:5000/recipes?page=500&per_page={}'.format(per_page),
+                  'prev': None, 'next': None},
+        'page': page,
+        'pages': 500,
+        'per_page': per_page,
+        'total': 500 * per_page,
+        'data': data,
+    }
+
+    # Flask-RESTful dumps with an indent of 4 when the app is in debug mode, compactly otherwise
+    return (json.dumps(body) + '\n').encode('utf-8')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=50, help='number of distinct pages compressed')
+    parser.add_argument('--per-page', type=int, default=20, help='recipes on a page')
+    parser.add_argument('--repeat', type=int, default=5, help='runs over the pages, the median is reported')
+    args = parser.parse_args(argv)
+
+    generator = RecipeGenerator(seed=1)
+    pages = [recipe_page(generator, page, args.per_page) for page in range(1, args.pages + 1)]
+    size = statistics.mean(len(page) for page in pages)
+
+    print('{} pages of {} recipes, {:.0f} bytes on average'.format(args.pages, args.per_page, size))
+    print('{:<10} {:>10} {:>8} {:>12}'.format('encoding', 'bytes', 'ratio', 'ms per page'))
+
+    for encoding, level in LEVELS:
+        if encoding == 'br' and brotli_module() is None:
+            print('{:<10} brotli is not installed'.format('br {}'.format(level)))
+            continue
+
+        times = []
+
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            compressed = [compress(page, encoding, level) for page in pages]
+            times.append((time.perf_counter() - start) / len(pages))
+
+        compressed_size = statistics.mean(len(page) for page in compressed)
+        print('{:<10} {:>10.0f} {:>7.1f}x {:>12.3f}'.format(
+            '{} {}'.format(encoding, level), compressed_size, size / compressed_size, statistics.median(times) * 1000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
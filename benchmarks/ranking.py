@@ -0,0 +1,69 @@
+# benchmarks/ranking.py file
+"""Benchmark of the sort=relevance ranking of ranking.py.
+
+Times the ranking of a batch of candidates, as get_ranked() receives them from
+the database: the conversion of the rows to a NumPy array, the scoring and the
+sort. The rows are random, with a match flag per term and field.
+
+    python -m benchmarks.ranking --candidates 10000 --terms 3
+"""
+
+# Import the necessary package and module
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from config import Config
+from ranking import RELEVANCE_FIELDS, match_bit, rank
+
+CONFIG = {name: getattr(Config, name) for name in dir(Config) if name.startswith('RELEVANCE_')}
+
+
+def candidate_rows(count, terms, rng, now):
+    """Function to build rows like the ones of get_ranked(): id, created_at (epoch), cook_time and the match bits"""
+    rows = []
+
+    for recipe_id in range(1, count + 1):
+        mask = sum(match_bit(i, j) for i in range(terms) for j in range(len(RELEVANCE_FIELDS)) if rng.random() < 0.3)
+        cook_time = None if rng.random() < 0.05 else rng.randint(1, 300)
+        rows.append((recipe_id, now - rng.random() * 730 * 86400, cook_time, mask))
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--candidates', type=int, default=10000, help='number of candidates ranked')
+    parser.add_argument('--terms', type=int, default=3, help='number of terms in the query')
+    parser.add_argument('--repeat', type=int, default=50, help='runs, the median is reported')
+    args = parser.parse_args(argv)
+
+    now = time.time()
+    rows = candidate_rows(args.candidates, args.terms, random.Random(1), now)
+
+    convert, ranking = [], []
+
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        candidates = np.array(rows, dtype=np.float64).reshape(len(rows), 4)
+        converted = time.perf_counter()
+        rank(candidates[:, 0].astype(np.int64), candidates[:, 3], args.terms, candidates[:, 1], candidates[:, 2],
+             now=now, config=CONFIG)
+        ranked = time.perf_counter()
+
+        convert.append(converted - start)
+        ranking.append(ranked - converted)
+
+    print('{} candidates, {} terms'.format(args.candidates, args.terms))
+    print('rows to array: {:8.2f} ms'.format(statistics.median(convert) * 1000))
+    print('score + sort:  {:8.2f} ms'.format(statistics.median(ranking) * 1000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# benchmarks/search.py file
+"""Benchmark of the pg_trgm search against a plain ILIKE scan.
+
+Times a few partial and misspelled queries through Recipe.get_all_published()
+on the database of the Benchmark configuration, once with a plain ILIKE and
+once with the pg_trgm search (load it first with 'flask data generate'):
+
+    python -m benchmarks.search
+"""
+
+# Import the necessary package and module
+import argparse
+import os
+import statistics
+import sys
+import time
+
+QUERIES = ['choc', 'pistach', 'chocolte', 'vanila', 'mascarpone', 'lemn tart', 'cardamom']
+
+
+def timed(function, repeat):
+    """Function to get the median time of a call, in milliseconds, and its last result"""
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times) * 1000, result
+
+
+def in_database(repeat):
+    """Function to compare the ILIKE scan with the pg_trgm search on the benchmark database"""
+    os.environ.setdefault('ENV', 'Benchmark')
+
+    from app import create_app
+    from models.recipe import Recipe
+
+    app = create_app()
+
+    print('{:<12} {:>12} {:>10} {:>12} {:>10}'.format('query', 'ILIKE ms', 'total', 'pg_trgm ms', 'total'))
+
+    with app.test_request_context():
+        for query in QUERIES:
+            results = []
+
+            for trigram in (False, True):
+                app.config['SEARCH_TRIGRAM_ENABLED'] = trigram
+
+                results.append(timed(
+                    lambda: Recipe.get_all_published(query, 1, 20, 'similarity', 'desc').total, repeat))
+
+            (ilike_ms, ilike_total), (trigram_ms, trigram_total) = results
+            print('{:<12} {:>12.2f} {:>10} {:>12.2f} {:>10}'.format(
+                query, ilike_ms, ilike_total, trigram_ms, trigram_total))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every query, the median is reported')
+    args = parser.parse_args(argv)
+
+    in_database(args.repeat)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
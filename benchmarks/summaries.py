@@ -0,0 +1,74 @@
+# benchmarks/summaries.py file
+"""Memory and speed of the summary store of summaries.py.
+
+Builds the store over synthetic published recipes from datagen.py, reports the
+memory it holds (traced with tracemalloc) and times a page read per sort
+column and an add and a remove, the updates done on publish and unpublish.
+
+    python -m benchmarks.summaries --rows 1000000
+"""
+
+# Import the necessary package and module
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+from datagen import RecipeGenerator
+from summaries import SUMMARY_COLUMNS, SummaryStore
+
+Row = namedtuple('Row', SUMMARY_COLUMNS)
+
+
+def median_ms(function, repeat):
+    """Function to get the median time of a call, in milliseconds"""
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='number of synthetic published recipes')
+    parser.add_argument('--repeat', type=int, default=100, help='runs of every operation, the median is reported')
+    args = parser.parse_args(argv)
+
+    generator = RecipeGenerator(seed=1)
+    rows = []
+
+    for recipe_id in range(1, args.rows + 1):
+        row = generator.recipe_row(user_id=generator.rng.randint(1, 10000))
+        rows.append(Row(recipe_id, row['cook_time'], row['num_of_servings'], row['created_at']))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = SummaryStore.build(rows)
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('built {} recipes in {:.1f} s'.format(len(store), seconds))
+    print('arrays: {:8.1f} MB, {:.0f} bytes per recipe'.format(size / 1024 / 1024, size / len(store)))
+    print()
+
+    for column in SummaryStore.SORT_COLUMNS:
+        for order in ('asc', 'desc'):
+            page_ms = median_ms(lambda: store.page_ids(column, order, 500, 20), args.repeat)
+            print('page 500 by {:<16} {:<4} {:8.3f} ms'.format(column, order, page_ms))
+
+    new_row = rows[len(rows) // 2]._replace(id=args.rows + 1)
+    add_ms = median_ms(lambda: (store.add(new_row), store.remove(new_row.id)), args.repeat)
+    print('add + remove                      {:8.3f} ms'.format(add_ms))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,367 @@
+# caching.py file
+
+# Import the necessary package and module
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request
+from flask_restful.representations.json import output_json
+from werkzeug.exceptions import NotFound
+
+from compression import compress_all, negotiate
+from extensions import cache
+
+# Requests counted in memory before they are merged into the statistics in the cache
+STATS_FLUSH_EVERY = 100
+
+# Query strings kept in the statistics of a path
+STATS_MAX_ENTRIES = 1000
+
+_stats_lock = threading.Lock()
+_pending_stats = {}
+
+
+def make_cache_key():
+    """Function to build the same key as @cache.cached(query_string=True): the path
+    followed by the md5 of the sorted query arguments, so clear_cache(path) still works"""
+    args_as_bytes = str(tuple(sorted(request.args.items(multi=True)))).encode()
+
+    return request.path + hashlib.md5(args_as_bytes).hexdigest()
+
+
+def stats_key(path):
+    """Function to get the key of the access statistics of a path"""
+    return 'stats:{}'.format(path)
+
+
+def record_access(path, query_string):
+    """Function to count a request of a cached path, merged into the cache every STATS_FLUSH_EVERY requests"""
+    with _stats_lock:
+        counter = _pending_stats.setdefault(path, Counter())
+        counter[query_string] += 1
+
+        if sum(counter.values()) < STATS_FLUSH_EVERY:
+            return
+
+        _pending_stats[path] = Counter()
+
+    # The merge is not atomic between workers, a few lost counts do not change the ranking
+    stats = cache.get(stats_key(path)) or {'queries': {}}
+    queries = Counter(stats['queries'])
+    queries.update(counter)
+
+    cache.set(stats_key(path), {
+        'base_url': request.host_url,
+        'queries': dict(queries.most_common(STATS_MAX_ENTRIES)),
+    }, timeout=0)
+
+
+def lock_key(key):
+    """Function to get the key of the lock held while an entry is recomputed"""
+    return 'lock:{}'.format(key)
+
+
+def single_flight(key, compute, timeout):
+    """Function to recompute a missing cache entry in a single worker at a time.
+
+    The worker that adds the lock key computes the value, the other ones wait
+    for it to show up in the cache, up to CACHE_LOCK_WAIT seconds, before they
+    compute it themselves. The lock is only shared between the workers when the
+    cache backend is, e.g. redis or memcached."""
+    if cache.add(lock_key(key), 1, timeout=current_app.config['CACHE_LOCK_TIMEOUT']):
+        try:
+            value = compute()
+
+            if _cacheable(value):
+                cache.set(key, value, timeout=timeout)
+
+            return value
+        finally:
+            cache.delete(lock_key(key))
+
+    deadline = time.monotonic() + current_app.config['CACHE_LOCK_WAIT']
+
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+
+        if value is not None:
+            return value
+
+        # The worker holding the lock gave up without storing the value
+        if cache.get(lock_key(key)) is None:
+            break
+
+    return compute()
+
+
+def _cacheable(value):
+    """Function to skip caching of the error responses"""
+    if isinstance(value, Entry):
+        value = value.value
+
+    return not (isinstance(value, tuple) and len(value) > 1 and value[1] >= 400)
+
+
+class Entry:
+    """Cached response of a list endpoint, fresh until 'expires' and served stale after that,
+    with its JSON body compressed in every available encoding"""
+    __slots__ = ('value', 'expires', 'compressed')
+
+    def __init__(self, value, expires, compressed=None):
+        self.value = value
+        self.expires = expires
+        self.compressed = compressed or {}
+
+    @classmethod
+    def make(cls, value, expires):
+        """This method builds the entry of a response, compressing its body once for all the cache hits"""
+        config = current_app.config
+        compressed = None
+
+        if config['COMPRESS_ENABLED'] and config['COMPRESS_CACHED_RESPONSES'] and _cacheable(value):
+            data, status = value if isinstance(value, tuple) else (value, 200)
+            body = output_json(data, status).get_data()
+            compressed = compress_all(body, config, cached=True)
+
+        return cls(value, expires, compressed)
+
+
+def _cache_control(max_age, stale_while_revalidate):
+    """Function to build the Cache-Control header of a cached response, so that a reverse
+    proxy or a CDN can serve it, and serve it stale while it revalidates"""
+    cache_control = 'public, max-age={}'.format(max(0, int(max_age)))
+
+    if stale_while_revalidate:
+        cache_control += ', stale-while-revalidate={}'.format(int(stale_while_revalidate))
+
+    return cache_control
+
+
+def _with_cache_control(value, max_age, stale_while_revalidate):
+    """Function to add the Cache-Control header to a (data, status) response"""
+    if not _cacheable(value):
+        return value
+
+    data, status = value if isinstance(value, tuple) else (value, 200)
+
+    return data, status, {'Cache-Control': _cache_control(max_age, stale_while_revalidate)}
+
+
+def _respond(entry, max_age, stale_while_revalidate):
+    """Function to serve a cache entry, with its precompressed body when the client accepts
+    one of its encodings. Flask-RESTful returns a Response object as it is"""
+    # The entries stored before the compression have no compressed bodies
+    compressed = getattr(entry, 'compressed', None) or {}
+    encoding = negotiate() if compressed else None
+
+    if encoding not in compressed:
+        return _with_cache_control(entry.value, max_age, stale_while_revalidate)
+
+    status = entry.value[1] if isinstance(entry.value, tuple) else 200
+    response = current_app.response_class(compressed[encoding], status=status, mimetype='application/json')
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = _cache_control(max_age, stale_while_revalidate)
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+def _refresh(app, key, path, base_url, query_string, compute, soft_timeout, hard_timeout):
+    """Function to recompute a stale entry in a background thread"""
+    try:
+        with app.test_request_context(path, base_url=base_url, query_string=query_string):
+            value = compute()
+
+            if _cacheable(value):
+                cache.set(key, Entry.make(value, time.time() + soft_timeout), timeout=hard_timeout)
+    except Exception:
+        app.logger.exception('Cache refresh of %s?%s failed', path, query_string)
+    finally:
+        with app.app_context():
+            cache.delete(lock_key(key))
+
+
+def cached_feed(soft_timeout=None, hard_timeout=None):
+    """Decorator to cache a list endpoint like @cache.cached(query_string=True), with
+    request coalescing on a miss and access statistics for the warm-up.
+
+    An entry is fresh for soft_timeout seconds. After that, and until hard_timeout,
+    it is served stale right away while a single worker refreshes it in the
+    background. The timeouts default to FEED_CACHE_SOFT_TIMEOUT and FEED_CACHE_HARD_TIMEOUT."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            config = current_app.config
+            soft = config['FEED_CACHE_SOFT_TIMEOUT'] if soft_timeout is None else soft_timeout
+            hard = config['FEED_CACHE_HARD_TIMEOUT'] if hard_timeout is None else hard_timeout
+            stale_while_revalidate = hard - soft if config['FEED_CACHE_STALE_WHILE_REVALIDATE'] else 0
+
+            key = make_cache_key()
+
+            # The requests of the warm-up itself are not counted
+            if not g.get('cache_warmup'):
+                record_access(request.path, request.query_string.decode())
+
+            entry = cache.get(key)
+            now = time.time()
+
+            if entry is not None and entry.expires > now:
+                return _respond(entry, entry.expires - now, stale_while_revalidate)
+
+            # The warm-up recomputes a stale entry itself, it runs in the Gunicorn master before
+            # the fork, where no refresh thread may be started
+            if entry is not None and stale_while_revalidate and not g.get('cache_warmup'):
+                # Serve the stale entry, and refresh it unless another worker is already at it
+                if cache.add(lock_key(key), 1, timeout=config['CACHE_LOCK_TIMEOUT']):
+                    threading.Thread(target=_refresh, daemon=True, args=(
+                        current_app._get_current_object(), key, request.path, request.host_url,
+                        request.query_string.decode(), lambda: f(*args, **kwargs), soft, hard)).start()
+
+                return _respond(entry, 0, stale_while_revalidate)
+
+            def compute():
+                return Entry.make(f(*args, **kwargs), time.time() + soft)
+
+            entry = single_flight(key, compute, hard)
+
+            return _respond(entry, entry.expires - time.time(), stale_while_revalidate)
+
+        return decorated_function
+
+    return decorator
+
+
+def warm_cache(app, path, top_n=None):
+    """Function to precompute the cached pages of a path for its most requested query strings.
+
+    The home feed (no query string) is always warmed. Returns the number of pages computed"""
+    with app.app_context():
+        g.cache_warmup = True
+
+        stats = cache.get(stats_key(path)) or {'queries': {}}
+        top_n = app.config['CACHE_WARM_TOP_N'] if top_n is None else top_n
+
+        query_strings = [''] + [query_string for query_string, _ in Counter(stats['queries']).most_common(top_n)
+                                if query_string]
+        base_url = stats.get('base_url') or app.config.get('CACHE_WARM_BASE_URL') or 'http://localhost/'
+
+        try:
+            endpoint, _ = app.url_map.bind('').match(path, method='GET')
+        except NotFound:
+            return 0
+
+        resource_class = app.view_functions[endpoint].view_class
+        warmed = 0
+
+        for query_string in query_strings[:top_n + 1]:
+            # The resource is called directly, the warm-up must not count against the rate limits
+            with app.test_request_context(path, base_url=base_url, query_string=query_string):
+                resource_class().get()
+
+            warmed += 1
+
+        return warmed
+
+
+class CacheWarmer:
+    """Run the warm-up of the paths in a background thread after they are invalidated.
+
+    There is at most one warm-up waiting per path in a worker: the invalidations that
+    come while it waits its delay are covered by it, so a burst of writes costs one
+    warm-up instead of one per write"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = set()
+        self._pending = set()
+
+    def schedule(self, app, path, delay=0):
+        """This method starts a warm-up of the path after delay seconds, unless one is already
+        waiting. When one is running, it runs once more after it"""
+        with self._lock:
+            if path in self._pending:
+                return
+
+            self._pending.add(path)
+
+            if path in self._running:
+                return
+
+            self._running.add(path)
+
+        threading.Thread(target=self._run, args=(app, path, delay), daemon=True).start()
+
+    def _run(self, app, path, delay):
+        while True:
+            time.sleep(delay)
+
+            with self._lock:
+                self._pending.discard(path)
+
+            try:
+                warm_cache(app, path)
+            except Exception:
+                app.logger.exception('Cache warm-up of %s failed', path)
+
+            with self._lock:
+                if path not in self._pending:
+                    self._running.discard(path)
+                    return
+
+
+warmer = CacheWarmer()
+
+
+class LRUCache:
+    """Small in-process cache of the most recently used keys, each one kept ttl seconds at most.
+
+    It holds values that rarely change, read on every request, so they do not need a
+    round trip to the shared cache nor to the database"""
+
+    def __init__(self, maxsize=1024, ttl=5*60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """This method returns the value of a key, None when it is missing or expired"""
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is None:
+                return None
+
+            value, expires = item
+
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+
+            self._items.move_to_end(key)
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        """This method stores a value, dropping the least recently used key past maxsize"""
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, *keys):
+        """This method removes keys, the missing ones are ignored"""
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        """This method removes every key"""
+        with self._lock:
+            self._items.clear()
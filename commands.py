@@ -0,0 +1,105 @@
+# commands.py file
+
+# Import the necessary package and module
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+# Group of the commands to manage the data, invoked with 'flask data <command>'
+data_cli = AppGroup('data', help='Generate and maintain the application data.')
+
+# Group of the commands to manage the cache, invoked with 'flask cache <command>'
+cache_cli = AppGroup('cache', help='Manage the response cache.')
+
+
+@data_cli.command('generate')
+@click.option('--users', default=1000, show_default=True, help='Number of users to create.')
+@click.option('--recipes', default=10000, show_default=True, help='Number of recipes to create.')
+@click.option('--publish-ratio', default=0.8, show_default=True, help='Share of published recipes.')
+@click.option('--author-skew', default=1.1, show_default=True,
+              help='Zipf exponent of the recipes per author, higher means fewer prolific authors.')
+@click.option('--days', default=730, show_default=True, help='Spread the creation dates over this many days.')
+@click.option('--password', default='password', show_default=True, help='Password of every generated user.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows sent per COPY/INSERT.')
+@click.option('--seed', type=int, default=None, help='Random seed, for reproducible data.')
+def generate_command(users, recipes, publish_ratio, author_skew, days, password, batch_size, seed):
+    """Bulk generate synthetic users and recipes for the scaling tests."""
+    from datagen import generate
+    from models.user import User
+    from utils import hash_password
+
+    if users == 0 and recipes and not User.query.first():
+        raise click.UsageError('Recipes need at least one user, use --users.')
+
+    # Hash the password once, every generated user shares it
+    loaded_users, loaded_recipes = generate(
+        users=users, recipes=recipes, password=hash_password(password), seed=seed,
+        publish_ratio=publish_ratio, author_skew=author_skew, days=days,
+        batch_size=batch_size, echo=click.echo)
+
+    click.echo('Generated {} users and {} recipes.'.format(loaded_users, loaded_recipes))
+
+    # The generated recipes skip Recipe.save(), parse their ingredients afterwards
+    if loaded_recipes:
+        backfill_ingredients(batch_size)
+
+
+@data_cli.command('backfill-ingredients')
+@click.option('--batch-size', default=5000, show_default=True, help='Recipes parsed per transaction.')
+def backfill_command(batch_size):
+    """Parse the ingredients of every recipe into the recipe_ingredient table.
+
+    Run it once after the migration that adds the table, it can be run again safely."""
+    backfill_ingredients(batch_size)
+
+
+def backfill_ingredients(batch_size):
+    """Function to parse the ingredients of every recipe, with the progress on the console"""
+    from models.ingredient import RecipeIngredient
+
+    recipes, rows = RecipeIngredient.backfill(
+        batch_size=batch_size, progress=lambda done: click.echo('{:>10} recipes'.format(done)))
+
+    click.echo('Parsed {} ingredients of {} recipes.'.format(rows, recipes))
+
+
+@data_cli.command('prune-tombstones')
+@click.option('--days', type=int, default=None, help='Keep this many days, SYNC_TOMBSTONE_RETENTION_DAYS by default.')
+def prune_tombstones_command(days):
+    """Delete the tombstones of the recipes deleted before the retention period.
+
+    The sync clients with an older cursor are asked to sync again from the start."""
+    from datetime import datetime, timedelta
+    from models.tombstone import RecipeTombstone
+
+    days = current_app.config['SYNC_TOMBSTONE_RETENTION_DAYS'] if days is None else days
+    pruned = RecipeTombstone.prune(before=datetime.utcnow() - timedelta(days=days))
+
+    click.echo('Pruned {} tombstones older than {} days.'.format(pruned, days))
+
+
+@data_cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Compute the statistics of GET /recipes/stats again from the recipe table.
+
+    Run it once after the migration that adds the recipe_stat table, the writes of the
+    recipes keep them up to date afterwards. The writes wait while it runs."""
+    from models.stats import RecipeStat
+
+    counters = RecipeStat.rebuild()
+
+    click.echo('Rebuilt {} counters of the recipe statistics.'.format(counters))
+
+
+@cache_cli.command('warm')
+@click.option('--path', default='/recipes', show_default=True, help='Cached list endpoint to warm.')
+@click.option('--top', type=int, default=None, help='Number of query strings, CACHE_WARM_TOP_N by default.')
+def warm_command(path, top):
+    """Precompute the most requested pages of a cached list endpoint.
+
+    Useful with a cache backend shared by the workers, such as redis."""
+    from caching import warm_cache
+
+    warmed = warm_cache(current_app._get_current_object(), path, top_n=top)
+
+    click.echo('Warmed {} pages of {}.'.format(warmed, path))
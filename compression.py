@@ -0,0 +1,123 @@
+# compression.py file
+"""gzip and brotli compression of the responses.
+
+Compression.init_app() registers an after_request hook that compresses the
+JSON responses of at least COMPRESS_MIN_SIZE bytes, with the best encoding the
+client accepts. The cached list pages are compressed once, when they are
+stored (see caching.py), and served as they are on the cache hits.
+
+Brotli is used when the 'brotli' package is installed, gzip otherwise.
+"""
+
+# Import the necessary package and module
+import gzip
+import io
+
+from flask import request
+
+from metrics import timed
+
+
+def brotli_module():
+    """Function to get the brotli module, None when it is not installed"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+
+    return brotli
+
+
+def available_encodings():
+    """Function to get the encodings the server can produce, the preferred one first"""
+    return ('br', 'gzip') if brotli_module() is not None else ('gzip', )
+
+
+def negotiate():
+    """Function to choose the encoding of the response from the Accept-Encoding header
+    of the current request, None for an uncompressed response"""
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding, level):
+    """Function to compress bytes with gzip (level 1 to 9) or brotli (quality 0 to 11)"""
+    if encoding == 'br':
+        return brotli_module().compress(data, quality=level)
+
+    # A fixed mtime, so the same payload always gives the same bytes
+    buffer = io.BytesIO()
+
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level, mtime=0) as file:
+        file.write(data)
+
+    return buffer.getvalue()
+
+
+def compress_all(data, config, cached=False):
+    """Function to compress a payload in every available encoding, for the cache.
+
+    Returns a dictionary from the encoding to the bytes, without the encodings when
+    the payload is under COMPRESS_MIN_SIZE"""
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return {}
+
+    return {encoding: compress(data, encoding, compression_level(encoding, config, cached))
+            for encoding in available_encodings()}
+
+
+def compression_level(encoding, config, cached=False):
+    """Function to get the compression level of an encoding. The cached payloads are
+    compressed once, with the slower but smaller levels"""
+    if encoding == 'br':
+        return config['COMPRESS_CACHED_BROTLI_QUALITY' if cached else 'COMPRESS_BROTLI_QUALITY']
+
+    return config['COMPRESS_CACHED_GZIP_LEVEL' if cached else 'COMPRESS_GZIP_LEVEL']
+
+
+class Compression:
+    """Compress the responses on the fly, when the views did not do it already"""
+
+    def __init__(self, app=None):
+        self.config = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """This method registers the after_request hook"""
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return
+
+        self.config = app.config
+        app.after_request(self._compress_response)
+        app.extensions['compression'] = self
+
+    def _compress_response(self, response):
+        """Compress a response, when it is worth it and the client accepts it"""
+        config = self.config
+
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES']
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate()
+        data = response.get_data()
+
+        if encoding is None or len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        with timed('compression'):
+            response.set_data(compress(data, encoding, compression_level(encoding, config)))
+
+        response.headers['Content-Encoding'] = encoding
+
+        # The compressed bytes differ from the identity ones, the validator becomes weak
+        etag, weak = response.get_etag()
+
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        return response
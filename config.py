@@ -2,6 +2,7 @@
 
 # Import the necessary package and module
 import os
+import tempfile
 
 
 class Config:
@@ -21,13 +22,144 @@ class Config:
     # Set the image destination folder
     UPLOADED_IMAGES_DEST = 'static/images'
 
+    # Set the limits of the uploads, checked before the body is read: size of the request in bytes
+    # per endpoint, and number of pixels of the image, read from its header before it is decoded
+    UPLOAD_MAX_COVER_SIZE = 5*1024*1024
+    UPLOAD_MAX_AVATAR_SIZE = 2*1024*1024
+    UPLOAD_MAX_IMAGE_PIXELS = 30*1000*1000
+
+    # Set the serving of the images on MEDIA_URL (see media.py). MEDIA_OFFLOAD lets the reverse proxy
+    # send the files: 'x-accel-redirect' for nginx, with an internal location on MEDIA_ACCEL_REDIRECT_PREFIX
+    # aliased to UPLOADED_IMAGES_DEST, or 'x-sendfile'. The uploaded images are cached as immutable
+    MEDIA_URL = '/media'
+    MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD')
+    MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media'
+    MEDIA_MAX_AGE = 24*60*60
+    MEDIA_IMMUTABLE_MAX_AGE = 365*24*60*60
+
     # Set caching-related
     CACHE_TYPE = 'simple'
     CACHE_DEFAULT_TIMEOUT = 10*60
 
+    # Seconds a worker may hold the lock to recompute a missing cache entry, and seconds
+    # the other workers wait for it before they compute the entry themselves
+    CACHE_LOCK_TIMEOUT = 10
+    CACHE_LOCK_WAIT = 5
+
+    # Number of the most requested query strings precomputed by the cache warm-up, run after
+    # the deploys and after the invalidations, at most once per CACHE_WARM_DELAY seconds per worker
+    CACHE_WARM_TOP_N = 20
+    CACHE_WARM_ON_INVALIDATE = True
+    CACHE_WARM_DELAY = 5
+
+    # The recipe list is fresh for FEED_CACHE_SOFT_TIMEOUT seconds. Until FEED_CACHE_HARD_TIMEOUT
+    # it is then served stale while it is refreshed in the background, the Cache-Control header
+    # lets a reverse proxy or a CDN do the same
+    FEED_CACHE_SOFT_TIMEOUT = 60
+    FEED_CACHE_HARD_TIMEOUT = 10*60
+    FEED_CACHE_STALE_WHILE_REVALIDATE = True
+
+    # Set the recipe search: the pg_trgm word similarity, or a plain ILIKE scan when it is
+    # disabled. Recipes with a similarity under SEARCH_SIMILARITY_THRESHOLD (0 to 1) are left out
+    SEARCH_TRIGRAM_ENABLED = True
+    SEARCH_SIMILARITY_THRESHOLD = 0.5
+
+    # Set the sort=relevance ranking of the recipe list (see ranking.py): weights of a query term
+    # found in each field, of the recency with its half-life, and of the shorter cook times. Only the
+    # newest RELEVANCE_MAX_CANDIDATES matching recipes are ranked, the pages stop there
+    RELEVANCE_FIELD_WEIGHTS = {'name': 3.0, 'description': 1.0, 'ingredients': 2.0}
+    RELEVANCE_RECENCY_WEIGHT = 1.0
+    RELEVANCE_HALF_LIFE_DAYS = 30
+    RELEVANCE_COOK_TIME_WEIGHT = 0.5
+    RELEVANCE_COOK_TIME_SCALE = 60
+    RELEVANCE_MAX_CANDIDATES = 10000
+
+    # Number of ingredients counted in the facets of the recipe list (?facets=true)
+    INGREDIENT_FACET_LIMIT = 20
+
+    # Set the suggestions of GET /recipes/suggestions. The prefix indexes of every worker are
+    # rebuilt every SUGGESTIONS_REFRESH seconds, browsers and proxies keep an answer SUGGESTIONS_MAX_AGE seconds
+    SUGGESTIONS_REFRESH = 5*60
+    SUGGESTIONS_MAX_LIMIT = 20
+    SUGGESTIONS_MAX_AGE = 60
+
+    # Set the materialized feeds of the newest published recipes, globally and per author. Every
+    # feed keeps the ids of up to MATERIALIZED_FEED_LENGTH recipes, the older pages come from the database.
+    # With the 'simple' cache every worker has its own feeds and misses the writes of the others, they are
+    # then kept MATERIALIZED_FEED_LOCAL_TIMEOUT seconds only
+    MATERIALIZED_FEEDS_ENABLED = True
+    MATERIALIZED_FEED_LENGTH = 5000
+    MATERIALIZED_FEED_TIMEOUT = 60*60
+    MATERIALIZED_FEED_LOCAL_TIMEOUT = 60
+
+    # Set the change feed of GET /recipes/changes: changes per call, changes of the last seconds left
+    # for the next call (so slower transactions are not skipped), and how long the deletions are kept.
+    # The lag has to be longer than the time from the write of a recipe to the commit of its request:
+    # the writes are stamped when they run, and the request is committed after the view returned
+    SYNC_MAX_BATCH = 500
+    SYNC_SAFETY_LAG = 5
+    SYNC_TOMBSTONE_RETENTION_DAYS = 90
+
+    # Set the statistics of GET /recipes/stats: days of new recipes and number of top authors returned
+    # by default and at most, and how long browsers and proxies keep an answer
+    STATS_DAYS = 30
+    STATS_MAX_DAYS = 366
+    STATS_TOP_AUTHORS = 10
+    STATS_MAX_TOP_AUTHORS = 100
+    STATS_MAX_AGE = 60
+
+    # Rows of the counters written by every recipe (totals, days, servings), so that the concurrent
+    # writes do not all wait on the same row lock. Run 'flask data rebuild-stats' after a change
+    STATS_SHARDS = 16
+
+    # Set the summary store: the page of GET /recipes without search nor filters is sorted and
+    # paginated in memory (see summaries.py), rebuilt every SUMMARY_STORE_REFRESH seconds. It takes
+    # about 27 MB per 1M published recipes in every worker, and a build thread per refresh
+    SUMMARY_STORE_ENABLED = False
+    SUMMARY_STORE_REFRESH = 5*60
+
+    # Set the gzip/brotli compression of the JSON responses of at least COMPRESS_MIN_SIZE bytes.
+    # The cached list pages are compressed once with the slower COMPRESS_CACHED_* levels
+    COMPRESS_ENABLED = True
+    COMPRESS_MIMETYPES = ['application/json']
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    COMPRESS_CACHED_RESPONSES = True
+    COMPRESS_CACHED_GZIP_LEVEL = 9
+    COMPRESS_CACHED_BROTLI_QUALITY = 11
+
+    # Read the author of the recipes from the snapshot columns of the recipe table, without a join. A
+    # new avatar is then not cleared from the cached pages, they show the previous one until they expire
+    AUTHOR_SNAPSHOT_ENABLED = True
+
+    # Seconds the id of a username is kept in the cache of every worker
+    USER_ID_CACHE_TTL = 5*60
+
     # Set rate limit
     RATELIMIT_HEADERS_ENABLED = True
 
+    # Set request instrumentation, exposed in the Prometheus text format on METRICS_URL. Off unless
+    # METRICS_ENABLED=true, the route has no authentication: keep it behind the proxy, for the scraper only
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_URL = '/metrics'
+
+    # Log the SQL statements slower than this number of seconds, together with their parameters
+    SLOW_QUERY_THRESHOLD = 0.5
+
+    # Ids of the users allowed on the admin endpoints, comma separated in the environment
+    ADMIN_USER_IDS = [int(user_id) for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if user_id]
+
+    # Set the sampling profiler (see profiling.py): fraction of the requests profiled, and the requests
+    # with the PROFILER_HEADER header sent by an admin. The stacks are taken every PROFILER_INTERVAL
+    # seconds and downloaded by the admins on PROFILER_URL
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() == 'true'
+    PROFILER_SAMPLE_RATE = 0.01
+    PROFILER_INTERVAL = 0.005
+    PROFILER_HEADER = 'X-Profile'
+    PROFILER_MAX_STACKS = 10000
+    PROFILER_URL = '/admin/profiles'
+
 
 class DevelopmentConfig(Config):
     # Set True for debugging purposes
@@ -50,4 +182,18 @@ class StagingConfig(Config):
 
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+
+
+class BenchmarkConfig(Config):
+    # Local database seeded by the benchmark suite, never point it to real data
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'BENCHMARK_DATABASE_URL', 'postgresql+psycopg2://localhost/data_recipe_benchmark')
+
+    SECRET_KEY = 'benchmark-secret-key'
+
+    # The benchmark drives the endpoints far beyond the rate limits
+    RATELIMIT_ENABLED = False
+
+    # Keep the uploaded images of the benchmark away from the static folder
+    UPLOADED_IMAGES_DEST = os.path.join(tempfile.gettempdir(), 'dessertrecipes-benchmark')
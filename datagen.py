@@ -0,0 +1,246 @@
+# datagen.py file
+"""Synthetic users and recipes for the scaling tests.
+
+The text of the recipes follows the shape of the real catalogue: a few very
+common ingredients (sugar, butter, eggs) and a long tail of rare ones, lists of
+3 to 15 ingredients, directions of a few sentences, mostly published recipes and
+a handful of prolific authors who wrote most of them.
+"""
+
+# Import the necessary package and module
+import csv
+import io
+import math
+import random
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from extensions import db
+from models.recipe import Recipe
+from models.stats import RecipeStat
+from models.user import User
+
+# Dessert ingredients, roughly from the most to the least used
+INGREDIENTS = [
+    'sugar', 'butter', 'eggs', 'flour', 'milk', 'vanilla extract', 'salt', 'heavy cream', 'baking powder',
+    'brown sugar', 'dark chocolate', 'cocoa powder', 'baking soda', 'cream cheese', 'icing sugar', 'lemon',
+    'honey', 'cinnamon', 'almonds', 'condensed milk', 'strawberries', 'gelatin', 'yogurt', 'oats', 'walnuts',
+    'white chocolate', 'coconut', 'raspberries', 'hazelnuts', 'mascarpone', 'orange', 'nutmeg', 'ginger',
+    'blueberries', 'apples', 'bananas', 'caramel', 'maple syrup', 'pecans', 'pistachios', 'cardamom', 'rum',
+    'espresso', 'ricotta', 'peaches', 'cherries', 'mango', 'lime', 'matcha', 'rose water', 'saffron',
+    'passion fruit', 'tahini', 'figs', 'chestnuts', 'lavender', 'yuzu', 'black sesame', 'miso', 'tonka bean',
+]
+
+UNITS = ['g', 'ml', 'cups', 'tbsp', 'tsp', '']
+
+DESSERTS = [
+    'cake', 'cheesecake', 'brownies', 'cookies', 'tart', 'pie', 'mousse', 'pudding', 'panna cotta', 'ice cream',
+    'muffins', 'macarons', 'tiramisu', 'crumble', 'souffle', 'flan', 'truffles', 'cupcakes', 'pavlova', 'eclairs',
+]
+
+ADJECTIVES = [
+    'classic', 'easy', 'rich', 'light', 'vegan', 'gluten-free', 'no-bake', 'grandma\'s', 'quick', 'fluffy',
+    'silky', 'crunchy', 'spiced', 'frozen', 'rustic', 'mini', 'double', 'salted',
+]
+
+STEPS = [
+    'Preheat the oven to {temp} degrees.',
+    'Whisk the {a} and the {b} until pale and fluffy.',
+    'Fold in the {a} gently with a spatula.',
+    'Melt the {a} over a bain-marie and let it cool slightly.',
+    'Sift the {a} together with the {b}.',
+    'Pour the batter into the prepared tin and smooth the top.',
+    'Bake for {minutes} minutes, until a skewer comes out clean.',
+    'Chill in the fridge for at least {hours} hours.',
+    'Decorate with the {a} just before serving.',
+    'Let it rest for {minutes} minutes before slicing.',
+]
+
+
+def zipf_cum_weights(n, exponent):
+    """Function to get the cumulative weights of a Zipf distribution over n ranks"""
+    return list(accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def weighted_sample(population, cum_weights, k, rng):
+    """Function to pick k distinct items following the cumulative weights"""
+    chosen = set()
+    total = cum_weights[-1]
+
+    while len(chosen) < k:
+        chosen.add(population[bisect(cum_weights, rng.random() * total)])
+
+    return list(chosen)
+
+
+class RecipeGenerator:
+    """Generate the rows of the user and recipe tables"""
+
+    def __init__(self, seed=None, publish_ratio=0.8, author_skew=1.1, days=730):
+        self.rng = random.Random(seed)
+        self.publish_ratio = publish_ratio
+        self.author_skew = author_skew
+        self.days = days
+        self.ingredient_weights = zipf_cum_weights(len(INGREDIENTS), 1.0)
+        self.now = datetime.utcnow()
+
+    def user_row(self, number, password):
+        """This method returns the row of a user"""
+        created_at = self.now - timedelta(seconds=self.rng.randint(0, self.days * 86400))
+
+        return {
+            'username': 'user{}'.format(number),
+            'email': 'user{}@example.com'.format(number),
+            'password': password,
+            'is_active': self.rng.random() < 0.95,
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+
+    def ingredients(self):
+        """This method returns a list of 3 to 15 ingredients with their quantities"""
+        count = min(15, max(3, int(self.rng.lognormvariate(math.log(7), 0.35))))
+        lines = []
+
+        for name in weighted_sample(INGREDIENTS, self.ingredient_weights, count, self.rng):
+            unit = self.rng.choice(UNITS)
+            quantity = self.rng.choice([1, 2, 3, 4, 50, 100, 125, 200, 250, 500])
+            lines.append('{} {} {}'.format(quantity, unit, name).replace('  ', ' '))
+
+        return ', '.join(lines)
+
+    def directions(self):
+        """This method returns between 3 and 12 steps, cut to the column size"""
+        steps = []
+
+        for _ in range(self.rng.randint(3, 12)):
+            a, b = weighted_sample(INGREDIENTS, self.ingredient_weights, 2, self.rng)
+            steps.append(self.rng.choice(STEPS).format(
+                a=a, b=b, temp=self.rng.choice([160, 170, 180, 190]),
+                minutes=self.rng.choice([10, 15, 20, 25, 35, 45]), hours=self.rng.randint(1, 8)))
+
+        return ' '.join(steps)[:1000]
+
+    def recipe_row(self, user_id):
+        """This method returns the row of a recipe written by user_id"""
+        flavour = weighted_sample(INGREDIENTS, self.ingredient_weights, 1, self.rng)[0]
+        dessert = self.rng.choice(DESSERTS)
+        created_at = self.now - timedelta(seconds=int(self.days * 86400 * self.rng.random() ** 2))
+
+        return {
+            'name': '{} {} {}'.format(self.rng.choice(ADJECTIVES), flavour, dessert).capitalize()[:100],
+            'description': 'A {} {} with {}.'.format(self.rng.choice(ADJECTIVES), dessert, flavour)[:200],
+            'num_of_servings': min(50, max(1, int(self.rng.gauss(8, 4)))),
+            'cook_time': min(300, max(1, int(self.rng.lognormvariate(math.log(45), 0.7)))),
+            'ingredients': self.ingredients()[:1000],
+            'directions': self.directions(),
+            'is_publish': self.rng.random() < self.publish_ratio,
+            'created_at': created_at,
+            'updated_at': created_at,
+            'user_id': user_id,
+        }
+
+    def recipe_rows(self, user_ids, count):
+        """This method yields the recipes, most of them written by a few prolific authors"""
+        # Shuffle the authors, so the prolific ones are not always the oldest users
+        authors = list(user_ids)
+        self.rng.shuffle(authors)
+        cum_weights = zipf_cum_weights(len(authors), self.author_skew)
+        total = cum_weights[-1]
+
+        for _ in range(count):
+            yield self.recipe_row(authors[bisect(cum_weights, self.rng.random() * total)])
+
+
+def bulk_load(table, rows, batch_size=10000, progress=None):
+    """Function to insert the rows in batches, through COPY on PostgreSQL"""
+    engine = db.engine
+    loaded = 0
+    batch = []
+
+    def flush():
+        if engine.dialect.name == 'postgresql':
+            _copy(engine, table, batch)
+        else:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+
+        if progress:
+            progress(loaded)
+
+    for row in rows:
+        batch.append(row)
+        loaded += 1
+
+        if len(batch) == batch_size:
+            flush()
+            batch = []
+
+    if batch:
+        flush()
+
+    return loaded
+
+
+def _copy(engine, table, rows):
+    """Function to send a batch of rows to PostgreSQL with COPY ... FROM STDIN"""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+
+    buffer.seek(0)
+
+    preparer = engine.dialect.identifier_preparer
+    statement = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        preparer.format_table(table), ', '.join(preparer.quote(column) for column in columns))
+
+    connection = engine.raw_connection()
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(statement, buffer)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def generate(users, recipes, password, seed=None, publish_ratio=0.8, author_skew=1.1, days=730,
+             batch_size=10000, echo=print):
+    """Function to generate and load the users and the recipes, returns the number of rows loaded"""
+    generator = RecipeGenerator(seed=seed, publish_ratio=publish_ratio, author_skew=author_skew, days=days)
+    first_user_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    start = time.perf_counter()
+
+    def progress(kind, total):
+        def report(loaded):
+            elapsed = time.perf_counter() - start
+            echo('{:>10} / {} {} ({:.0f} rows/s)'.format(loaded, total, kind, loaded / elapsed if elapsed else 0))
+        return report
+
+    loaded_users = bulk_load(
+        User.__table__,
+        (generator.user_row(first_user_id + i, password) for i in range(users)),
+        batch_size=batch_size, progress=progress('users', users))
+
+    user_ids = [row.id for row in db.session.query(User.id).filter(User.id >= first_user_id)]
+
+    if not user_ids:
+        user_ids = [row.id for row in db.session.query(User.id)]
+
+    loaded_recipes = bulk_load(
+        Recipe.__table__, generator.recipe_rows(user_ids, recipes),
+        batch_size=batch_size, progress=progress('recipes', recipes))
+
+    # Copy the authors on the recipes, in a single statement
+    Recipe.update_author_snapshot()
+    db.session.commit()
+
+    # The rows were copied without Recipe.save(), count them in the statistics again
+    RecipeStat.rebuild()
+
+    return loaded_users, loaded_recipes
@@ -7,9 +7,15 @@ from flask_uploads import UploadSet, IMAGES
 from flask_caching import Cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from compression import Compression
+from media import Media
+from metrics import RequestMetrics
+from profiling import SamplingProfiler
+from transactions import UnitOfWork
 
-# Create an instance of SQLAlchemy object
-db = SQLAlchemy()
+# Create an instance of SQLAlchemy object. The objects are not expired on commit, the
+# response of a write is built from the values sent with the statement and its RETURNING
+db = SQLAlchemy(session_options={'expire_on_commit': False})
 # Create an instance of Flask JWT Extended object
 jwt = JWTManager()
 # Create an instance of Flask Upload object
@@ -17,4 +23,14 @@ image_set = UploadSet('images', IMAGES)
 # Create an instance of Flask Cache object
 cache = Cache()
 # Create an instance of Limiter object
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+limiter = Limiter(key_func=get_remote_address)
+# Create an instance of the request metrics object
+metrics = RequestMetrics()
+# Create an instance of the response compression object
+compression = Compression()
+# Create an instance of the image serving object
+media = Media()
+# Create an instance of the unit of work object, one transaction per request
+unit_of_work = UnitOfWork()
+# Create an instance of the sampling profiler object
+profiler = SamplingProfiler()
\ No newline at end of file
@@ -0,0 +1,204 @@
+# feeds.py file
+"""Materialized "latest published" feeds of the recipes, globally and per author.
+
+A feed is the list of the ids of the newest published recipes, kept in the cache
+as two compact arrays (the creation times and the ids, oldest first). It is
+built with a single query on the first read, then updated in place when a recipe
+is published, unpublished or deleted, so a profile page is a slice of the array
+and one batch query on the primary keys, instead of a paginated query with a
+count over all the recipes of the author.
+
+The updates read, change and write back the feed. With a cache shared between
+the workers, two concurrent updates can lose one of them, the feed is rebuilt
+after MATERIALIZED_FEED_TIMEOUT seconds at the latest. With a cache of the
+process ('simple'), a worker only updates its own feeds and does not see the
+writes of the others, so the feeds are rebuilt after
+MATERIALIZED_FEED_LOCAL_TIMEOUT seconds instead. That is the same age as the
+cached pages of the recipe list, so the pages built from a feed are no staler
+than the pages were before the feeds.
+"""
+
+# Import the necessary package and module
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy import desc
+
+from extensions import cache, db
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def feed_key(user_id=None):
+    """Function to get the cache key of the feed of an author, or of the global feed"""
+    return 'feed:all' if user_id is None else 'feed:user:{}'.format(user_id)
+
+
+def stale_key(user_id=None):
+    """Function to get the cache key of the time a change found no feed to update"""
+    return 'stale:{}'.format(feed_key(user_id))
+
+
+def feed_timeout():
+    """Function to get the seconds a feed is kept, short when every worker has its own cache"""
+    config = current_app.config
+
+    if config['CACHE_TYPE'] in ('simple', 'null'):
+        return min(config['MATERIALIZED_FEED_TIMEOUT'], config['MATERIALIZED_FEED_LOCAL_TIMEOUT'])
+
+    return config['MATERIALIZED_FEED_TIMEOUT']
+
+
+def timestamp(created_at):
+    """Function to get the seconds since the epoch of a naive UTC datetime"""
+    return (created_at - EPOCH).total_seconds()
+
+
+class Feed:
+    """Ids of the newest published recipes, by creation time, and the number of recipes of the whole feed"""
+    __slots__ = ('created', 'ids', 'total')
+
+    def __init__(self, rows, total):
+        # The rows come newest first, the arrays are kept oldest first so that bisect works on them
+        self.created = array('d', reversed([timestamp(row.created_at) for row in rows]))
+        self.ids = array('I', reversed([row.id for row in rows]))
+        self.total = total
+
+    def __getstate__(self):
+        return self.created, self.ids, self.total
+
+    def __setstate__(self, state):
+        self.created, self.ids, self.total = state
+
+    @property
+    def complete(self):
+        """True when every recipe of the feed is in the arrays"""
+        return len(self.ids) >= self.total
+
+    def page_ids(self, page, per_page):
+        """This method returns the ids of a page, newest first, or None if the page is past the arrays"""
+        end = len(self.ids) - (page - 1) * per_page
+        start = end - per_page
+
+        if start < 0 and not self.complete:
+            return None
+
+        return list(reversed(self.ids[max(0, start):max(0, end)]))
+
+    def insert(self, recipe_id, created_at, max_length):
+        """This method adds a recipe at its place, dropping the oldest one past max_length"""
+        self.remove(recipe_id)
+        created = timestamp(created_at)
+        self.total += 1
+
+        # Older than every recipe kept, it is only counted
+        if not self.complete and self.created and created < self.created[0]:
+            return
+
+        i = bisect_right(self.created, created)
+        self.created.insert(i, created)
+        self.ids.insert(i, recipe_id)
+
+        while len(self.ids) > max_length:
+            self.created.pop(0)
+            self.ids.pop(0)
+
+    def remove(self, recipe_id):
+        """This method removes a recipe from the feed, if it is there"""
+        try:
+            i = self.ids.index(recipe_id)
+        except ValueError:
+            return False
+
+        self.created.pop(i)
+        self.ids.pop(i)
+        self.total -= 1
+
+        return True
+
+
+class LatestFeeds:
+    """Read and maintain the materialized feeds in the cache"""
+
+    @staticmethod
+    def build(user_id=None):
+        """This method builds a feed with a single query on the published recipes"""
+        from models.recipe import Recipe
+
+        max_length = current_app.config['MATERIALIZED_FEED_LENGTH']
+        query = db.session.query(Recipe.id, Recipe.created_at).filter(Recipe.is_publish.is_(True))
+
+        if user_id is not None:
+            query = query.filter(Recipe.user_id == user_id)
+
+        rows = query.order_by(desc(Recipe.created_at), desc(Recipe.id)).limit(max_length).all()
+        total = len(rows) if len(rows) < max_length else query.order_by(None).count()
+
+        return Feed(rows, total)
+
+    def get(self, user_id=None):
+        """This method returns a feed from the cache, building it on a miss"""
+        feed = cache.get(feed_key(user_id))
+
+        if feed is None:
+            started = time.time()
+            feed = self.build(user_id)
+
+            # A change made while the feed was built may be missing from it, it is served
+            # this once but not stored, the next read builds it again
+            if (cache.get(stale_key(user_id)) or 0) < started:
+                cache.set(feed_key(user_id), feed, timeout=feed_timeout())
+
+        return feed
+
+    def paginate(self, user_id, page, per_page):
+        """This method returns the page of a feed as a Flask-SQLAlchemy Pagination, with the
+        recipes loaded in one query, or None when it has to be served by the database:
+        the feeds are disabled, the page is past the materialized ids, or it is out of range"""
+        from models.recipe import Recipe
+
+        if not current_app.config['MATERIALIZED_FEEDS_ENABLED'] or page < 1 or per_page < 1:
+            return None
+
+        feed = self.get(user_id)
+        ids = feed.page_ids(page, per_page)
+
+        # Let paginate() answer the pages that do not exist with its usual 404
+        if ids is None or (not ids and page != 1):
+            return None
+
+        return Pagination(None, page, per_page, feed.total, Recipe.get_by_ids(ids))
+
+    def _update(self, user_ids, change):
+        """This method applies a change to the cached feeds, the missing ones are built on their next read"""
+        timeout = feed_timeout()
+
+        for user_id in user_ids:
+            feed = cache.get(feed_key(user_id))
+
+            if feed is not None:
+                change(feed)
+                cache.set(feed_key(user_id), feed, timeout=timeout)
+            else:
+                cache.set(stale_key(user_id), time.time(), timeout=timeout)
+
+    def publish(self, recipe_id, user_id, created_at):
+        """This method adds a published recipe to the global feed and to the feed of its author"""
+        max_length = current_app.config['MATERIALIZED_FEED_LENGTH']
+        self._update((None, user_id), lambda feed: feed.insert(recipe_id, created_at, max_length))
+
+    def unpublish(self, recipe_id, user_id):
+        """This method removes an unpublished or deleted recipe from the feeds"""
+        def remove(feed):
+            # A recipe past the materialized ids is only counted
+            if not feed.remove(recipe_id) and not feed.complete:
+                feed.total -= 1
+
+        self._update((None, user_id), remove)
+
+
+latest_feeds = LatestFeeds()
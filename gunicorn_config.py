@@ -0,0 +1,58 @@
+# gunicorn_config.py file
+
+# Import the necessary package and module
+import gc
+import os
+
+# The number of workers is read by Gunicorn from WEB_CONCURRENCY, as set by Heroku
+
+# Load the app in the master before forking, so the workers share its memory copy-on-write
+# and start serving right away. Set GUNICORN_PRELOAD=false to load the app in every worker.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def when_ready(server):
+    """Warm up the preloaded app in the master, once, before the workers are forked"""
+    if not preload_app:
+        return
+
+    from caching import warm_cache
+    from main import app
+    from search import recipe_suggestions
+    from summaries import recipe_summaries
+    from utils import preload_modules
+
+    preload_modules()
+
+    # Build the in-memory indexes first, in this thread: the warm-up reads the summary store,
+    # and a missing store would start a build thread in the master right before the fork.
+    # The workers share them until their first refresh
+    recipe_suggestions.rebuild(app)
+    summaries_built = not app.config['SUMMARY_STORE_ENABLED'] or recipe_summaries.rebuild(app)
+
+    # Precompute the most requested recipe list pages, the workers start with a warm cache
+    if not summaries_built:
+        server.log.warning('Summary store build failed, cache warm-up skipped')
+    else:
+        try:
+            warm_cache(app, '/recipes')
+        except Exception:
+            server.log.exception('Cache warm-up failed')
+
+    # Move the objects created so far out of the garbage collector generations, so the
+    # collections in the workers do not touch (and copy) the pages shared with the master
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """Do not share the database connections opened by the master with the workers"""
+    if not preload_app:
+        return
+
+    from extensions import db
+    from main import app
+
+    with app.app_context():
+        db.engine.dispose()
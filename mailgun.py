@@ -1,8 +1,5 @@
 # mailgun.py file
 
-# Import the necessary package and module
-import requests
-
 
 class MailgunApi:
 
@@ -17,6 +14,9 @@ class MailgunApi:
 
     def send_email(self, to, subject, text, html=None):
         """Sending out emails using the Mailgun API"""
+        # requests is imported on first use, to keep the boot of the workers fast
+        import requests
+
         if not isinstance(to, (list, tuple)):
             to = [to, ]
 
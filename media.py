@@ -0,0 +1,90 @@
+# media.py file
+"""Serving of the uploaded images (covers, avatars and the default assets).
+
+Media.init_app() registers the MEDIA_URL route, in place of the static route
+of Flask for the files of UPLOADED_IMAGES_DEST. The file itself is sent by:
+
+- the reverse proxy, when MEDIA_OFFLOAD is 'x-accel-redirect' (nginx, with an
+  internal location on MEDIA_ACCEL_REDIRECT_PREFIX) or 'x-sendfile' (Apache
+  mod_xsendfile, lighttpd), the worker only answers the headers;
+- send_file() otherwise, with the conditional (ETag, Last-Modified) and the
+  Range requests, and the sendfile() system call of Gunicorn for the whole files.
+
+The images saved by compress_image() have a new random name on every upload,
+they never change and are cached for a year as immutable.
+"""
+
+# Import the necessary package and module
+import mimetypes
+import os
+import re
+
+from flask import Response, abort, send_file
+from werkzeug.security import safe_join
+
+# Name of the files saved by compress_image(), a uuid4 with the extension
+UPLOADED_FILENAME = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}\.[a-z]+$')
+
+
+def is_immutable(filename):
+    """Function to know if a file is an uploaded image, whose content never changes"""
+    return UPLOADED_FILENAME.match(os.path.basename(filename)) is not None
+
+
+def max_age(filename, config):
+    """Function to get the number of seconds a file can be cached"""
+    return config['MEDIA_IMMUTABLE_MAX_AGE'] if is_immutable(filename) else config['MEDIA_MAX_AGE']
+
+
+def cache_control(filename, config):
+    """Function to build the Cache-Control header of a file"""
+    if is_immutable(filename):
+        return 'public, max-age={}, immutable'.format(max_age(filename, config))
+
+    return 'public, max-age={}'.format(max_age(filename, config))
+
+
+class Media:
+    """Serve the uploaded images, or let the reverse proxy serve them"""
+
+    def __init__(self, app=None):
+        self.config = None
+        self.folder = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """This method registers the media route, the images are saved in UPLOADED_IMAGES_DEST"""
+        self.config = app.config
+        self.folder = os.path.abspath(app.config['UPLOADED_IMAGES_DEST'])
+
+        app.add_url_rule(app.config['MEDIA_URL'].rstrip('/') + '/<path:filename>', 'media', self.serve)
+        app.extensions['media'] = self
+
+    def serve(self, filename):
+        """View function of the media route"""
+        config = self.config
+        path = safe_join(self.folder, filename)
+
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        offload = config['MEDIA_OFFLOAD']
+
+        if offload in ('x-accel-redirect', 'x-sendfile'):
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = Response(mimetype=mimetype)
+
+            if offload == 'x-accel-redirect':
+                response.headers['X-Accel-Redirect'] = config['MEDIA_ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/' + \
+                    filename
+            else:
+                response.headers['X-Sendfile'] = path
+        else:
+            # send_file() answers 304 and 206 itself, and ETag and Last-Modified come from the file
+            response = send_file(path, conditional=True, cache_timeout=max_age(filename, config))
+
+        response.headers['Cache-Control'] = cache_control(filename, config)
+
+        return response
@@ -0,0 +1,216 @@
+# metrics.py file
+
+# Import the necessary package and module
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Logger for the statements slower than SLOW_QUERY_THRESHOLD
+slow_query_logger = logging.getLogger('dessertrecipes.slow_query')
+
+# Upper bounds (in seconds) of the request duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phases of a request that are measured apart from the wall time
+PHASES = ('db', 'serialization', 'image', 'compression')
+
+
+@contextmanager
+def timed(phase):
+    """Context manager to add the elapsed time of a block to a phase of the current request"""
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        if has_request_context() and hasattr(g, 'metrics_phases'):
+            g.metrics_phases[phase] += time.perf_counter() - start
+
+
+class EndpointStats:
+    """Aggregated timings of a single (endpoint, method) pair"""
+    __slots__ = ('count', 'wall', 'buckets', 'phases', 'queries', 'statuses')
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.statuses = {}
+
+
+class RequestMetrics:
+    """Per endpoint timing of the requests, exposed in the Prometheus text format.
+
+    The numbers are kept in memory, so each Gunicorn worker reports its own
+    requests. Every worker adds a 'pid' label to tell the series apart."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.slow_queries = 0
+        self.slow_query_threshold = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """This method registers the request hooks, the SQLAlchemy events and the /metrics route"""
+        if not app.config.get('METRICS_ENABLED'):
+            return
+
+        self.slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD')
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        # Listen on the Engine class, so the engine created lazily by Flask-SQLAlchemy is covered
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        app.add_url_rule(app.config.get('METRICS_URL', '/metrics'), 'metrics', self.expose)
+
+        app.extensions['metrics'] = self
+
+    @staticmethod
+    def _start_request():
+        """Start the clock of the request"""
+        g.metrics_start = time.perf_counter()
+        g.metrics_phases = dict.fromkeys(PHASES, 0.0)
+        g.metrics_queries = 0
+
+    def _finish_request(self, response):
+        """Stop the clock of the request and add it to the endpoint statistics"""
+        start = getattr(g, 'metrics_start', None)
+
+        if start is not None:
+            self.observe(
+                endpoint=request.endpoint or 'unknown',
+                method=request.method,
+                status=response.status_code,
+                wall=time.perf_counter() - start,
+                phases=g.metrics_phases,
+                queries=g.metrics_queries)
+
+        return response
+
+    def observe(self, endpoint, method, status, wall, phases, queries=0):
+        """This method adds a finished request to the statistics"""
+        with self._lock:
+            stats = self._endpoints.get((endpoint, method))
+
+            if stats is None:
+                stats = self._endpoints[(endpoint, method)] = EndpointStats()
+
+            stats.count += 1
+            stats.wall += wall
+            stats.buckets[bisect_left(BUCKETS, wall)] += 1
+            stats.queries += queries
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+            for phase, elapsed in phases.items():
+                stats.phases[phase] += elapsed
+
+    def record_slow_query(self, statement, parameters, elapsed):
+        """This method logs a statement slower than the threshold together with its parameters"""
+        with self._lock:
+            self.slow_queries += 1
+
+        slow_query_logger.warning(
+            'Slow query (%.3fs) on %s: %s; parameters: %.500r',
+            elapsed,
+            request.endpoint if has_request_context() else '-',
+            ' '.join(statement.split()),
+            parameters)
+
+    def render(self):
+        """This method renders the statistics in the Prometheus text exposition format"""
+        pid = os.getpid()
+        lines = []
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+
+            lines.append('# HELP dessertrecipes_request_duration_seconds Wall time of the requests.')
+            lines.append('# TYPE dessertrecipes_request_duration_seconds histogram')
+
+            for (endpoint, method), stats in endpoints:
+                labels = 'pid="{}",endpoint="{}",method="{}"'.format(pid, endpoint, method)
+                cumulative = 0
+
+                for bound, count in zip(BUCKETS + ('+Inf',), stats.buckets):
+                    cumulative += count
+                    lines.append('dessertrecipes_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                        labels, bound, cumulative))
+
+                lines.append('dessertrecipes_request_duration_seconds_sum{{{}}} {:.6f}'.format(labels, stats.wall))
+                lines.append('dessertrecipes_request_duration_seconds_count{{{}}} {}'.format(labels, stats.count))
+
+            lines.append('# HELP dessertrecipes_request_phase_seconds_total Time spent in each phase of the requests.')
+            lines.append('# TYPE dessertrecipes_request_phase_seconds_total counter')
+
+            for (endpoint, method), stats in endpoints:
+                for phase in PHASES:
+                    lines.append(
+                        'dessertrecipes_request_phase_seconds_total'
+                        '{{pid="{}",endpoint="{}",method="{}",phase="{}"}} {:.6f}'.format(
+                            pid, endpoint, method, phase, stats.phases[phase]))
+
+            lines.append('# HELP dessertrecipes_db_queries_total Statements executed by the requests.')
+            lines.append('# TYPE dessertrecipes_db_queries_total counter')
+
+            for (endpoint, method), stats in endpoints:
+                lines.append('dessertrecipes_db_queries_total{{pid="{}",endpoint="{}",method="{}"}} {}'.format(
+                    pid, endpoint, method, stats.queries))
+
+            lines.append('# HELP dessertrecipes_responses_total Responses by status code.')
+            lines.append('# TYPE dessertrecipes_responses_total counter')
+
+            for (endpoint, method), stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(
+                        'dessertrecipes_responses_total{{pid="{}",endpoint="{}",method="{}",status="{}"}} {}'.format(
+                            pid, endpoint, method, status, count))
+
+            lines.append('# HELP dessertrecipes_slow_queries_total Statements slower than the threshold.')
+            lines.append('# TYPE dessertrecipes_slow_queries_total counter')
+            lines.append('dessertrecipes_slow_queries_total{{pid="{}"}} {}'.format(pid, self.slow_queries))
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        """Save the start time of the statement on its execution context, a statement that
+        raises leaves nothing behind on the pooled connection"""
+        if context is not None:
+            context._metrics_query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """Add the time of the statement to the DB phase of the current request"""
+        start = getattr(context, '_metrics_query_start', None)
+
+        if start is None:
+            return
+
+        elapsed = time.perf_counter() - start
+
+        if has_request_context() and hasattr(g, 'metrics_phases'):
+            g.metrics_phases['db'] += elapsed
+            g.metrics_queries += 1
+
+        if self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold:
+            self.record_slow_query(statement, parameters, elapsed)
+
+    def expose(self):
+        """View function of the /metrics route"""
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
@@ -1,6 +1,8 @@
 from __future__ import with_statement
 
 import logging
+import os
+import sys
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -17,6 +19,9 @@ config = context.config
 fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
+# Let the revisions import the helpers of online.py, for the changes on the large tables
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
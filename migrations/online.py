@@ -0,0 +1,125 @@
+"""Helpers for the migrations that must not lock the large tables.
+
+Imported by the revisions as 'import online' (env.py puts this folder on the
+path). On PostgreSQL:
+
+- create_index() and drop_index() run CREATE/DROP INDEX CONCURRENTLY outside
+  of the migration transaction: the writes go on while the index is built. An
+  index left INVALID by a failed build is dropped and built again, an index
+  already built is skipped, so a failed 'flask db upgrade' can be run again.
+- backfill() runs an UPDATE in batches of primary keys, each one committed on
+  its own, with a pause between the batches and the progress in the log.
+- lock_timeout() bounds the wait of the DDL that needs a short exclusive lock
+  (ADD COLUMN, ADD CONSTRAINT ... NOT VALID), so that a long transaction makes
+  the migration fail fast instead of queueing every write behind it.
+
+On the other databases they fall back to the plain Alembic operations.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.online')
+
+
+def is_postgresql():
+    """Function to know if the migration runs on PostgreSQL"""
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def index_state(name):
+    """Function to get the state of an index on PostgreSQL: None when it does not exist,
+    True when it is valid, False when a concurrent build failed and left it invalid"""
+    return op.get_bind().execute(sa.text(
+        'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE c.relname = :name AND pg_catalog.pg_table_is_visible(c.oid)'), name=name).scalar()
+
+
+def create_index(name, table, columns, **kwargs):
+    """Function to build an index without blocking the writes on the table"""
+    if not is_postgresql():
+        op.create_index(name, table, columns, **kwargs)
+        return
+
+    with op.get_context().autocommit_block():
+        state = index_state(name)
+
+        if state is True:
+            logger.info('Index %s already exists, skipped', name)
+            return
+
+        if state is False:
+            logger.info('Index %s is invalid, dropped and built again', name)
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+        start = time.monotonic()
+        op.create_index(name, table, columns, postgresql_concurrently=True, **kwargs)
+        logger.info('Index %s built in %.1f s', name, time.monotonic() - start)
+
+
+def drop_index(name, table):
+    """Function to drop an index without blocking the writes on the table"""
+    if not is_postgresql():
+        op.drop_index(name, table_name=table)
+        return
+
+    with op.get_context().autocommit_block():
+        if index_state(name) is not None:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+
+@contextmanager
+def lock_timeout(milliseconds=5000):
+    """Context manager to make the statements of the block give up after waiting a lock
+    that long, for the schema changes that only hold their lock for an instant"""
+    if not is_postgresql():
+        yield
+        return
+
+    op.execute('SET LOCAL lock_timeout = {:d}'.format(milliseconds))
+
+    try:
+        yield
+    finally:
+        op.execute('SET LOCAL lock_timeout = DEFAULT')
+
+
+def backfill(table, values, where=None, key='id', batch_size=10000, pause=0.1):
+    """Function to run UPDATE table SET values [WHERE where] in batches of batch_size keys.
+
+    Every batch is committed on its own, so the row locks are held shortly and the
+    vacuum keeps up, with pause seconds between the batches to leave room for the
+    traffic. values maps the column names to SQL expressions, where is an optional
+    SQL condition. A batch already done is not updated again if where excludes it,
+    so a backfill that was interrupted can be run again. Returns the rows updated"""
+    bind = op.get_bind()
+    table = sa.table(table, sa.column(key), *[sa.column(column) for column in values])
+    key_column = table.c[key]
+
+    low, high = bind.execute(sa.select([sa.func.min(key_column), sa.func.max(key_column)])).first()
+
+    if low is None:
+        return 0
+
+    updated = 0
+    start = time.monotonic()
+    condition = sa.true() if where is None else sa.text(where)
+
+    with op.get_context().autocommit_block():
+        for first in range(low, high + 1, batch_size):
+            statement = table.update().values(**{column: sa.text(expression) for column, expression in values.items()})
+            statement = statement.where(sa.and_(key_column >= first, key_column < first + batch_size, condition))
+            updated += bind.execute(statement).rowcount
+
+            done = min(first + batch_size, high + 1) - low
+            elapsed = time.monotonic() - start
+            logger.info('Backfill of %s: %d%% of the keys, %d rows updated, %.0f rows/s', table.name,
+                        100 * done // (high + 1 - low), updated, updated / elapsed if elapsed else 0)
+
+            if pause:
+                time.sleep(pause)
+
+    return updated
@@ -0,0 +1,28 @@
+"""change feed timestamps taken at the time of the write
+
+Revision ID: 2e6d9f3a8c47
+Revises: 7c3e9a4b1f58
+Create Date: 2026-10-21 10:12:31.640285
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e6d9f3a8c47'
+down_revision = '7c3e9a4b1f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # now() is the start of the transaction, which spans the whole request: a slow request
+    # would commit a change stamped further back than the lag of the change feed
+    op.alter_column('recipe', 'updated_at', server_default=sa.text('clock_timestamp()'))
+    op.alter_column('recipe_tombstone', 'deleted_at', server_default=sa.text('clock_timestamp()'))
+
+
+def downgrade():
+    op.alter_column('recipe_tombstone', 'deleted_at', server_default=sa.text('now()'))
+    op.alter_column('recipe', 'updated_at', server_default=sa.text('now()'))
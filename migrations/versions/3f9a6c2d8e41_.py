@@ -0,0 +1,33 @@
+"""trigram indexes for the recipe search
+
+Revision ID: 3f9a6c2d8e41
+Revises: c0f3fc276148
+Create Date: 2026-10-19 10:12:31.402116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import online
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a6c2d8e41'
+down_revision = 'c0f3fc276148'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # Built concurrently, the recipes can still be written during the deploy
+    for column in ('name', 'description', 'ingredients'):
+        online.create_index(
+            'ix_recipe_{}_trgm'.format(column), 'recipe', [column],
+            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    for column in ('name', 'description', 'ingredients'):
+        online.drop_index('ix_recipe_{}_trgm'.format(column), 'recipe')
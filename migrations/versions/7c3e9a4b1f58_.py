@@ -0,0 +1,34 @@
+"""shards of the recipe_stat counters
+
+Revision ID: 7c3e9a4b1f58
+Revises: b8d25e6f1c37
+Create Date: 2026-10-20 15:36:48.205117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9a4b1f58'
+down_revision = 'b8d25e6f1c37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The existing counters become shard 0, the reads add up the shards
+    op.add_column('recipe_stat', sa.Column('shard', sa.SmallInteger(), server_default='0', nullable=False))
+    op.drop_constraint('recipe_stat_pkey', 'recipe_stat', type_='primary')
+    op.create_primary_key('recipe_stat_pkey', 'recipe_stat', ['metric', 'bucket', 'shard'])
+    op.alter_column('recipe_stat', 'shard', server_default=None)
+
+
+def downgrade():
+    # Fold the shards of every counter back into a single row
+    op.drop_constraint('recipe_stat_pkey', 'recipe_stat', type_='primary')
+    op.execute('WITH shards AS (DELETE FROM recipe_stat RETURNING *) '
+               'INSERT INTO recipe_stat (metric, bucket, shard, count, total) '
+               'SELECT metric, bucket, 0, sum(count), sum(total) FROM shards GROUP BY metric, bucket')
+    op.create_primary_key('recipe_stat_pkey', 'recipe_stat', ['metric', 'bucket'])
+    op.drop_column('recipe_stat', 'shard')
@@ -0,0 +1,40 @@
+"""author snapshot columns on the recipe table
+
+Revision ID: e4b7c1a9f062
+Revises: 5d2b8f0e7a13
+Create Date: 2026-10-20 09:41:17.664208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import online
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c1a9f062'
+down_revision = '5d2b8f0e7a13'
+branch_labels = None
+depends_on = None
+
+AUTHOR_COLUMNS = ('username', 'avatar_image', 'created_at', 'updated_at')
+
+
+def upgrade():
+    # Nullable columns without a default, added without rewriting the table
+    with online.lock_timeout():
+        op.add_column('recipe', sa.Column('author_username', sa.String(length=80), nullable=True))
+        op.add_column('recipe', sa.Column('author_avatar_image', sa.String(length=100), nullable=True))
+        op.add_column('recipe', sa.Column('author_created_at', sa.DateTime(), nullable=True))
+        op.add_column('recipe', sa.Column('author_updated_at', sa.DateTime(), nullable=True))
+
+    # The recipes not filled yet show the author from the user table
+    online.backfill('recipe', {
+        'author_{}'.format(column): '(SELECT "user".{0} FROM "user" WHERE "user".id = recipe.user_id)'.format(column)
+        for column in AUTHOR_COLUMNS
+    }, where='author_username IS NULL AND user_id IS NOT NULL')
+
+
+def downgrade():
+    for column in reversed(AUTHOR_COLUMNS):
+        op.drop_column('recipe', 'author_{}'.format(column))
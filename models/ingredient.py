@@ -0,0 +1,129 @@
+# models/ingredient.py file
+"""Normalized ingredients of the recipes.
+
+Recipe.ingredients stays the free-form text written by the author. Every time
+it is saved, it is also parsed into one row per ingredient in recipe_ingredient,
+so "the recipes with almonds" is an index lookup instead of a text scan:
+"2 cups of Almonds, 1 egg" gives "almond" and "egg".
+"""
+
+# Import the necessary package and module
+import re
+
+from sqlalchemy import desc, func
+
+from extensions import db
+
+# Words dropped in front of the name of an ingredient
+UNITS = {
+    'g', 'gr', 'gram', 'grams', 'kg', 'mg', 'ml', 'cl', 'dl', 'l', 'litre', 'litres', 'liter', 'liters', 'oz',
+    'ounce', 'ounces', 'lb', 'lbs', 'pound', 'pounds', 'cup', 'cups', 'tbsp', 'tbs', 'tablespoon', 'tablespoons',
+    'tsp', 'teaspoon', 'teaspoons', 'pinch', 'pinches', 'dash', 'handful', 'can', 'cans', 'pack', 'packs',
+    'stick', 'sticks', 'slice', 'slices', 'piece', 'pieces', 'large', 'medium', 'small', 'of', 'a', 'an',
+}
+
+_separators = re.compile(r'[,;\n]+')
+_parentheses = re.compile(r'\([^)]*\)')
+_words = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+
+
+def singular(word):
+    """Function to get a rough singular of an English word, applied the same way
+    to the recipes and to the filters so that they always agree"""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('ches', 'shes', 'sses', 'xes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us')):
+        return word[:-1]
+
+    return word
+
+
+def normalize_ingredient(text):
+    """Function to get the normalized name of an ingredient line, without the
+    quantity and the unit, or None when nothing is left"""
+    words = _words.findall(_parentheses.sub(' ', text.lower()))
+
+    while words and words[0] in UNITS:
+        words.pop(0)
+
+    if not words:
+        return None
+
+    words[-1] = singular(words[-1])
+
+    return ' '.join(words)[:100]
+
+
+def parse_ingredients(text):
+    """Function to get the sorted, distinct normalized names of an ingredient list"""
+    names = (normalize_ingredient(line) for line in _separators.split(text or ''))
+
+    return sorted({name for name in names if name})
+
+
+class RecipeIngredient(db.Model):
+    __tablename__ = 'recipe_ingredient'
+
+    # Define our RecipeIngredient model, one row per distinct ingredient of a recipe
+    recipe_id = db.Column(db.Integer(), db.ForeignKey('recipe.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(100), primary_key=True)
+
+    # The filters and the facets go from the name to the recipes
+    __table_args__ = (db.Index('ix_recipe_ingredient_name_recipe_id', 'name', 'recipe_id'), )
+
+    @classmethod
+    def sync(cls, rows):
+        """This method replaces the ingredients of the (recipe_id, ingredients) rows, in the
+        current transaction. The caller commits"""
+        rows = list(rows)
+
+        if not rows:
+            return 0
+
+        table = cls.__table__
+        db.session.execute(table.delete().where(table.c.recipe_id.in_([recipe_id for recipe_id, _ in rows])))
+
+        values = [{'recipe_id': recipe_id, 'name': name}
+                  for recipe_id, ingredients in rows for name in parse_ingredients(ingredients)]
+
+        if values:
+            db.session.execute(table.insert(), values)
+
+        return len(values)
+
+    @classmethod
+    def backfill(cls, batch_size=1000, progress=None):
+        """This method parses the ingredients of every recipe, a batch per transaction.
+
+        Returns the number of recipes and of ingredient rows"""
+        from models.recipe import Recipe
+
+        last_id = 0
+        recipes = rows = 0
+
+        while True:
+            batch = db.session.query(Recipe.id, Recipe.ingredients).filter(
+                Recipe.id > last_id).order_by(Recipe.id).limit(batch_size).all()
+
+            if not batch:
+                return recipes, rows
+
+            rows += cls.sync(batch)
+            db.session.commit()
+
+            recipes += len(batch)
+            last_id = batch[-1].id
+
+            if progress:
+                progress(recipes)
+
+    @classmethod
+    def counts(cls, recipe_ids, limit):
+        """This method counts the most used ingredients among the recipe_ids subquery"""
+        count = func.count().label('count')
+
+        return db.session.query(cls.name, count).join(
+            recipe_ids, recipe_ids.c.id == cls.recipe_id).group_by(cls.name).order_by(
+            desc(count), cls.name).limit(limit).all()
@@ -1,8 +1,39 @@
 # models/recipe.py file
 
 # Import the necessary package and module
+from datetime import datetime, timedelta
+
+from flask import abort, current_app
+from flask_sqlalchemy import Pagination
 from extensions import db
-from sqlalchemy import asc, desc, or_
+from sqlalchemy import and_, asc, case, desc, exists, extract, func, inspect, literal, or_, select, tuple_, union_all
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models.ingredient import RecipeIngredient, normalize_ingredient
+from models.stats import STATS_COLUMNS, RecipeStat, stat_values
+from models.tombstone import RecipeTombstone
+from models.user import User
+from transactions import commit
+
+# Upper bounds of the cook_time (minutes) and num_of_servings facet ranges, the last range is open
+COOK_TIME_RANGES = (15, 30, 60, 120)
+SERVINGS_RANGES = (2, 4, 8, 12)
+
+# Columns of the user copied on the recipes, as author_<column>, for the author of the representation
+AUTHOR_SNAPSHOT_COLUMNS = ('username', 'avatar_image', 'created_at', 'updated_at')
+
+
+class AuthorSnapshot:
+    """Author of a recipe, read from the snapshot columns of the recipe instead of the user table"""
+    __slots__ = ('id', ) + AUTHOR_SNAPSHOT_COLUMNS
+
+    def __init__(self, id, username, avatar_image, created_at, updated_at):
+        self.id = id
+        self.username = username
+        self.avatar_image = avatar_image
+        self.created_at = created_at
+        self.updated_at = updated_at
 
 
 class Recipe(db.Model):
@@ -19,40 +50,481 @@ class Recipe(db.Model):
     cover_image = db.Column(db.String(100), default=None)
     is_publish = db.Column(db.Boolean(), default=False)
     created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
-    updated_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+    # The time of the write itself, not of the start of its transaction (see get_changes)
+    updated_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.clock_timestamp(),
+                           onupdate=db.func.clock_timestamp())
 
     user_id = db.Column(db.Integer(), db.ForeignKey('user.id'))
 
+    # Snapshot of the author, kept up to date by User.save(), so the reads do not join the user table
+    author_username = db.Column(db.String(80))
+    author_avatar_image = db.Column(db.String(100))
+    author_created_at = db.Column(db.DateTime())
+    author_updated_at = db.Column(db.DateTime())
+
+    # Trigram indexes of the searched columns (pg_trgm), they also serve the ILIKE '%q%' scans,
+    # indexes of the range filters of the published recipes and of the change feed
+    __table_args__ = tuple(
+        db.Index('ix_recipe_{}_trgm'.format(column), column,
+                 postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+        for column in ('name', 'description', 'ingredients')) + (
+        db.Index('ix_recipe_is_publish_cook_time', 'is_publish', 'cook_time'),
+        db.Index('ix_recipe_is_publish_num_of_servings', 'is_publish', 'num_of_servings'),
+        db.Index('ix_recipe_updated_at_id', 'updated_at', 'id'))
+
+    # Fetch created_at and updated_at with the RETURNING of the INSERT and the UPDATE, instead of
+    # expiring them and loading them again on the next access
+    __mapper_args__ = {'eager_defaults': True}
+
+    # Kinds of the entries of the change feed, in their order on a same timestamp
+    CHANGE_UPDATED = 0
+    CHANGE_DELETED = 1
+
+    # Columns matched by the search
+    SEARCH_COLUMNS = ('name', 'description', 'ingredients')
+
+    @property
+    def author(self):
+        """The author of the recipe: the snapshot when it is enabled and filled, the user otherwise"""
+        if self.author_username is None or not current_app.config['AUTHOR_SNAPSHOT_ENABLED']:
+            return self.user
+
+        return AuthorSnapshot(self.user_id, *[getattr(self, 'author_{}'.format(name))
+                                              for name in AUTHOR_SNAPSHOT_COLUMNS])
+
     @classmethod
-    def get_all_published(cls, q, page, per_page, sort, order):
-        """This method is used to leverage the paginate method"""
+    def update_author_snapshot(cls, user_id=None):
+        """This method copies the columns of the author on all the recipes of user_id, in a single
+        UPDATE recipe ... FROM user statement, or on every recipe without a snapshot yet.
+        Returns the number of recipes updated"""
+        recipe = cls.__table__
+        user = User.__table__
+
+        # The author is not the content of the recipes: keep their updated_at, so their ETags
+        # stay valid and they do not come back in the change feed
+        statement = recipe.update().values(updated_at=recipe.c.updated_at, **{
+            'author_{}'.format(name): user.c[name] for name in AUTHOR_SNAPSHOT_COLUMNS
+        }).where(recipe.c.user_id == user.c.id)
+
+        if user_id is not None:
+            statement = statement.where(user.c.id == user_id)
+        else:
+            statement = statement.where(recipe.c.author_username.is_(None))
+
+        return db.session.execute(statement).rowcount
+
+    @classmethod
+    def search(cls, query, q):
+        """This method filters the query on the recipes matching q, with typo tolerance.
+
+        It uses the pg_trgm word similarity, served by the trigram indexes, or a plain
+        ILIKE scan when SEARCH_TRIGRAM_ENABLED is off. Returns the filtered query and the
+        similarity expression, used to sort by relevance"""
+        columns = [getattr(cls, name) for name in cls.SEARCH_COLUMNS]
         keyword = '%{keyword}%'.format(keyword=q)
 
-        if order == 'asc':
-            sort_logic = asc(getattr(cls, sort))
+        if current_app.config['SEARCH_TRIGRAM_ENABLED']:
+            # The cut-off of the %> operator is SEARCH_SIMILARITY_THRESHOLD, set on every
+            # connection by init_trigram_search()
+            # column %> q is true when q is similar to a word of the column, the percent
+            # sign is doubled for the pyformat parameters of psycopg2
+            similarity = func.greatest(*[func.word_similarity(q, func.coalesce(column, '')) for column in columns])
+            matches = [column.ilike(keyword) for column in columns] + [column.op('%%>')(q) for column in columns]
+
+            return query.filter(or_(*matches)), similarity
+
+        return query.filter(or_(*[column.ilike(keyword) for column in columns])), None
+
+    @classmethod
+    def filter_by_ingredients(cls, query, include=(), exclude=()):
+        """This method keeps the recipes with all the include ingredients and none of the
+        exclude ones, looked up in the recipe_ingredient index"""
+        def has(name):
+            return exists().where(and_(
+                RecipeIngredient.recipe_id == cls.id, RecipeIngredient.name == normalize_ingredient(name)))
+
+        for name in include:
+            if normalize_ingredient(name):
+                query = query.filter(has(name))
+
+        for name in exclude:
+            if normalize_ingredient(name):
+                query = query.filter(~has(name))
+
+        return query
+
+    @classmethod
+    def filter_by_ranges(cls, query, min_cook_time=None, max_cook_time=None, min_servings=None, max_servings=None):
+        """This method keeps the recipes within the cook_time and num_of_servings bounds, inclusive"""
+        bounds = [
+            (cls.cook_time, min_cook_time, max_cook_time),
+            (cls.num_of_servings, min_servings, max_servings),
+        ]
+
+        for column, low, high in bounds:
+            if low is not None:
+                query = query.filter(column >= low)
+            if high is not None:
+                query = query.filter(column <= high)
+
+        return query
+
+    @classmethod
+    def published(cls, q, filters=None):
+        """This method builds the query of the published recipes matching q and the filters
+        (include, exclude, min_cook_time, max_cook_time, min_servings and max_servings).
+
+        Returns the query and the similarity expression of the search"""
+        filters = filters or {}
+        query = cls.query.filter(cls.is_publish.is_(True))
+        similarity = None
+
+        if q:
+            query, similarity = cls.search(query, q)
+
+        query = cls.filter_by_ingredients(query, filters.get('include') or (), filters.get('exclude') or ())
+        query = cls.filter_by_ranges(query, **{
+            name: filters.get(name) for name in ('min_cook_time', 'max_cook_time', 'min_servings', 'max_servings')})
+
+        return query, similarity
+
+    @classmethod
+    def get_all_published(cls, q, page, per_page, sort, order, filters=None):
+        """This method is used to leverage the paginate method"""
+        query, similarity = cls.published(q, filters)
+
+        if sort == 'relevance':
+            return cls.get_ranked(query, q, page, per_page, order)
+
+        # The most similar recipes first, the newest ones first on a tie
+        if sort == 'similarity':
+            if similarity is None:
+                sort_logic = [desc(cls.created_at)]
+            elif order == 'asc':
+                sort_logic = [asc(similarity), desc(cls.created_at)]
+            else:
+                sort_logic = [desc(similarity), desc(cls.created_at)]
+        elif order == 'asc':
+            sort_logic = [asc(getattr(cls, sort))]
         else:
-            sort_logic = desc(getattr(cls, sort))
+            sort_logic = [desc(getattr(cls, sort))]
+
+        return query.order_by(*sort_logic).paginate(page=page, per_page=per_page)
+
+    @classmethod
+    def get_ranked(cls, query, q, page, per_page, order):
+        """This method has got the logic to sort the recipes of the query by relevance (see ranking.py).
+
+        The newest RELEVANCE_MAX_CANDIDATES recipes of the query are fetched with a match flag
+        per term and field, ranked in one NumPy pass, and the recipes of the page are loaded
+        in a single query. Only the candidates are ranked, so they are the total of the
+        pagination. Returns a Flask-SQLAlchemy Pagination"""
+        import numpy as np
+        from ranking import RELEVANCE_FIELDS, match_bit, query_terms, rank
 
-        return cls.query.filter(
-            or_(cls.name.ilike(keyword),
-                cls.description.ilike(keyword),
-                cls.ingredients.ilike(keyword)),
-            cls.is_publish.is_(True)).order_by(sort_logic).paginate(page=page, per_page=per_page)
+        config = current_app.config
+
+        if page < 1 or per_page < 1:
+            abort(404)
+
+        # One bit per term found in a field, summed in a single column
+        terms = query_terms(q or '')
+        mask = sum((case([(getattr(cls, field).ilike('%{}%'.format(term)), match_bit(i, j))], else_=0)
+                    for i, term in enumerate(terms) for j, field in enumerate(RELEVANCE_FIELDS)), literal(0))
+        rows = query.with_entities(cls.id, extract('epoch', cls.created_at), cls.cook_time, mask).order_by(
+            desc(cls.created_at)).limit(config['RELEVANCE_MAX_CANDIDATES']).all()
+
+        # A single conversion of the rows, None becomes NaN
+        candidates = np.array(rows, dtype=np.float64).reshape(len(rows), 4)
+
+        ranked = rank(candidates[:, 0].astype(np.int64), candidates[:, 3], len(terms), candidates[:, 1],
+                      candidates[:, 2], now=(datetime.utcnow() - datetime(1970, 1, 1)).total_seconds(),
+                      config=config, order=order)
+        items = cls.get_by_ids([int(recipe_id) for recipe_id in ranked[(page - 1) * per_page:page * per_page]])
+
+        if not items and page != 1:
+            abort(404)
+
+        return Pagination(None, page, per_page, len(rows), items)
+
+    @staticmethod
+    def range_counts(query, column, upper_bounds):
+        """This method counts the recipes of the query in the ranges of a column, e.g.
+        '1-15', '16-30' and '31+' for the upper bounds (15, 30)"""
+        ranges = []
+        low = 1
+
+        for high in upper_bounds:
+            ranges.append((column <= high, '{}-{}'.format(low, high)))
+            low = high + 1
+
+        bucket = case(ranges, else_='{}+'.format(low)).label('range')
+        buckets = query.filter(column.isnot(None)).with_entities(bucket).subquery()
+        counts = dict(db.session.query(buckets.c.range, func.count()).group_by(buckets.c.range))
+
+        return [{'range': label, 'count': counts[label]}
+                for label in [label for _, label in ranges] + ['{}+'.format(low)] if label in counts]
+
+    @classmethod
+    def get_facets(cls, q, filters=None, limit=20):
+        """This method counts the published recipes matching q and the filters by ingredient
+        (the limit most used ones), by cook_time range and by num_of_servings range"""
+        query, _ = cls.published(q, filters)
+        ingredients = RecipeIngredient.counts(query.with_entities(cls.id).subquery(), limit)
+
+        return {
+            'ingredients': [{'name': name, 'count': count} for name, count in ingredients],
+            'cook_time': cls.range_counts(query, cls.cook_time, COOK_TIME_RANGES),
+            'num_of_servings': cls.range_counts(query, cls.num_of_servings, SERVINGS_RANGES),
+        }
 
     @classmethod
     def get_by_id(cls, recipe_id):
         """This method gets the recipes by ID"""
         return cls.query.filter_by(id=recipe_id).first()
 
+    @classmethod
+    def get_by_ids(cls, recipe_ids):
+        """This method loads the recipes and their authors in one query, in the order of recipe_ids"""
+        query = cls.query.filter(cls.id.in_(recipe_ids))
+
+        # The authors come from the snapshot columns, the join is only needed without them
+        if not current_app.config['AUTHOR_SNAPSHOT_ENABLED']:
+            query = query.options(joinedload(cls.user))
+
+        recipes = {recipe.id: recipe for recipe in query} if recipe_ids else {}
+
+        return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+    @classmethod
+    def get_owner_and_version(cls, recipe_id):
+        """This method gets only the user_id and updated_at of a recipe, to tell why a write did not match"""
+        return db.session.query(cls.user_id, cls.updated_at).filter_by(id=recipe_id).first()
+
+    @classmethod
+    def owned_update(cls, recipe_id, user_id, values, version=None, previous=(), changed_only=False):
+        """This method builds the UPDATE of a recipe that only matches when it is owned by user_id.
+
+        When version is given, the row also has to still have that updated_at. With
+        changed_only, the row also has to differ from one of the values. The columns
+        named in previous are joined from the row as it was before the update, so their
+        old values can be returned as previous_<column>. That row is read with FOR UPDATE:
+        a write waiting on the lock of a concurrent one then reads the row it replaces,
+        not the one of its snapshot"""
+        recipe = cls.__table__
+        conditions = [recipe.c.id == recipe_id, recipe.c.user_id == user_id]
+
+        if version is not None:
+            conditions.append(recipe.c.updated_at == version)
+
+        # Writing the values a recipe already has would only bump its updated_at
+        if changed_only and values:
+            conditions.append(or_(*[recipe.c[name].is_distinct_from(value) for name, value in values.items()]))
+
+        # Nothing to change: still check the owner and return the row, without bumping updated_at
+        if not values:
+            values = {'updated_at': recipe.c.updated_at}
+
+        statement = recipe.update().values(**values)
+        old_columns = []
+
+        if previous:
+            old = select([recipe]).where(and_(recipe.c.id == recipe_id, recipe.c.user_id == user_id)).with_for_update(
+            ).alias('old')
+            conditions.append(old.c.id == recipe.c.id)
+            old_columns = [old.c[name].label('previous_{}'.format(name)) for name in previous]
+
+        return statement.where(and_(*conditions)), old_columns
+
+    @classmethod
+    def update_owned(cls, recipe_id, user_id, values, version=None, returning=('id',), previous=(),
+                     changed_only=False):
+        """This method has got the logic to update a recipe owned by user_id, in a single
+        UPDATE ... WHERE id = :id AND user_id = :user_id RETURNING statement.
+
+        Returns the row with the returning columns and the previous_<column> values,
+        or None if the recipe does not exist, belongs to another user or, with
+        changed_only, already has the values"""
+        # A write of the columns of the statistics also returns them before and after it
+        counted = any(name in values for name in STATS_COLUMNS)
+
+        if counted:
+            returning = tuple(returning) + tuple(name for name in STATS_COLUMNS if name not in returning)
+            previous = tuple(previous) + tuple(name for name in STATS_COLUMNS if name not in previous)
+
+        statement, old_columns = cls.owned_update(recipe_id, user_id, values, version, previous, changed_only)
+        columns = [cls.__table__.c[name] for name in returning] + old_columns
+
+        row = db.session.execute(statement.returning(*columns)).first()
+
+        if row is not None and 'ingredients' in values:
+            RecipeIngredient.sync([(recipe_id, values['ingredients'])])
+
+        if row is not None and counted:
+            RecipeStat.change(before=stat_values(row, 'previous_'), after=stat_values(row))
+
+        commit()
+
+        return row
+
+    @classmethod
+    def delete_owned(cls, recipe_id, user_id, returning=('id', 'cover_image')):
+        """This method has got the logic to delete a recipe owned by user_id, in a single
+        DELETE ... WHERE id = :id AND user_id = :user_id RETURNING statement, with no ORM load.
+
+        Returns the row with the returning columns, or None if no recipe matched"""
+        recipe = cls.__table__
+        statement = recipe.delete().where(and_(recipe.c.id == recipe_id, recipe.c.user_id == user_id))
+        returning = tuple(returning) + tuple(name for name in STATS_COLUMNS if name not in returning)
+
+        row = db.session.execute(statement.returning(*[recipe.c[name] for name in returning])).first()
+
+        # Leave a tombstone for the sync clients and take the recipe out of the statistics, in the same transaction
+        if row is not None:
+            RecipeTombstone.record(recipe_id, user_id)
+            RecipeStat.change(before=stat_values(row))
+
+        commit()
+
+        return row
+
+    @classmethod
+    def get_changes(cls, cursor=None, limit=100, lag=0):
+        """This method has got the logic to read the change feed of the recipes: the recipes created
+        or updated (including the unpublished ones) and the deleted ones, after the cursor.
+
+        The cursor is the (changed_at, kind, id) of the last change read, the changes are in
+        that order, each branch served by its (timestamp, id) index. The changes of the last
+        'lag' seconds are left for the next call, so that a transaction that commits after
+        a later one is not skipped: updated_at and deleted_at are the clock_timestamp() of
+        the write, so the lag has to cover the time from a write to the commit of its request.
+        Returns the rows (id, changed_at, kind) of up to limit + 1 changes, the extra one
+        tells that there are more"""
+        recipe = cls.__table__
+        tombstone = RecipeTombstone.__table__
+        horizon = func.now() - timedelta(seconds=lag)
+
+        updated = select([
+            recipe.c.id, recipe.c.updated_at.label('changed_at'), literal(cls.CHANGE_UPDATED).label('kind')
+        ]).where(recipe.c.updated_at < horizon)
+
+        deleted = select([
+            tombstone.c.recipe_id.label('id'), tombstone.c.deleted_at.label('changed_at'),
+            literal(cls.CHANGE_DELETED).label('kind')
+        ]).where(tombstone.c.deleted_at < horizon)
+
+        if cursor is not None:
+            changed_at, kind, item_id = cursor
+
+            if kind == cls.CHANGE_UPDATED:
+                updated = updated.where(tuple_(recipe.c.updated_at, recipe.c.id) > tuple_(changed_at, item_id))
+                deleted = deleted.where(tombstone.c.deleted_at >= changed_at)
+            else:
+                updated = updated.where(recipe.c.updated_at > changed_at)
+                deleted = deleted.where(
+                    tuple_(tombstone.c.deleted_at, tombstone.c.recipe_id) > tuple_(changed_at, item_id))
+
+        # Every branch is limited on its own index before the merge
+        updated = updated.order_by(recipe.c.updated_at, recipe.c.id).limit(limit + 1)
+        deleted = deleted.order_by(tombstone.c.deleted_at, tombstone.c.recipe_id).limit(limit + 1)
+
+        changes = union_all(updated.alias().select(), deleted.alias().select()).alias('changes')
+        statement = select([changes]).order_by(changes.c.changed_at, changes.c.kind, changes.c.id).limit(limit + 1)
+
+        return db.session.execute(statement).fetchall()
+
+    @classmethod
+    def update_by_owner(cls, recipe_id, user_id, values, version=None):
+        """This method has got the logic to update only the given columns of a recipe owned by user_id.
+
+        It runs the statement of owned_update(), joined with the author, so there is no
+        load before and no SELECT after it. Returns the updated recipe with its author,
+        or None if no row matched"""
+        recipe = cls.__table__
+        user = User.__table__
+
+        # A write of the columns of the statistics also returns their previous values
+        counted = any(name in values for name in STATS_COLUMNS)
+
+        statement, old_columns = cls.owned_update(
+            recipe_id, user_id, values, version, previous=STATS_COLUMNS if counted else ())
+        updated = statement.returning(*(list(recipe.c) + old_columns)).cte('updated')
+
+        statement = select(
+            [updated] + [column.label('owner_{}'.format(column.name)) for column in user.c]
+        ).select_from(updated.join(user, updated.c.user_id == user.c.id))
+
+        row = db.session.execute(statement).first()
+
+        # Parse the new ingredients in the same transaction
+        if row is not None and 'ingredients' in values:
+            RecipeIngredient.sync([(recipe_id, values['ingredients'])])
+
+        if row is not None and counted:
+            RecipeStat.change(before=stat_values(row, 'previous_'), after=stat_values(row))
+
+        commit()
+
+        if row is None:
+            return None
+
+        # Build the objects from the returned row, outside of the session
+        result = cls(**{column.name: row[column.name] for column in recipe.c})
+        author = User(**{column.name: row['owner_{}'.format(column.name)] for column in user.c})
+        set_committed_value(result, 'user', author)
+
+        return result
+
     def save(self):
-        """This method persists data to the database"""
+        """This method persists data to the database, with the parsed ingredients. Inside a
+        request it is committed with the other writes of the request, see transactions.py"""
+        state = inspect(self)
+        ingredients_changed = state.attrs.ingredients.history.has_changes()
+        before = None if state.transient else self.previous_stat_values()
+
+        # A new recipe takes the snapshot of its author
+        if state.transient and self.author_username is None and self.user_id is not None:
+            author = db.session.query(*[getattr(User, name) for name in AUTHOR_SNAPSHOT_COLUMNS]).filter(
+                User.id == self.user_id).first()
+
+            if author is not None:
+                for name in AUTHOR_SNAPSHOT_COLUMNS:
+                    setattr(self, 'author_{}'.format(name), getattr(author, name))
+
         db.session.add(self)
-        db.session.commit()
+
+        # Flush first, the id and created_at of a new recipe come back with the RETURNING of the INSERT
+        db.session.flush()
+
+        if ingredients_changed:
+            RecipeIngredient.sync([(self.id, self.ingredients)])
+
+        RecipeStat.change(before=before, after=stat_values(self))
+        commit()
+
+    def previous_stat_values(self):
+        """This method gets the stat_values() of the recipe as they are in the database,
+        before the changes not flushed yet"""
+        state = inspect(self)
+        values = {}
+
+        for name in STATS_COLUMNS:
+            history = state.attrs[name].history
+
+            if history.added:
+                values[name] = history.deleted[0] if history.deleted else None
+            else:
+                values[name] = getattr(self, name)
+
+        return values
 
     def delete(self):
-        """This method deletes data from the database"""
+        """This method deletes data from the database, leaves a tombstone for the sync clients
+        and takes the recipe out of the statistics"""
+        RecipeStat.change(before=self.previous_stat_values())
         db.session.delete(self)
-        db.session.commit()
+        RecipeTombstone.record(self.id, self.user_id)
+        commit()
 
     @classmethod
     def get_all_by_user(cls, user_id, page, per_page, visibility='public'):
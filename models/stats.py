@@ -0,0 +1,197 @@
+# models/stats.py file
+"""Rollups of the recipe statistics, maintained with the writes of the recipes.
+
+Every write of a recipe moves its contribution between a few counters of the
+recipe_stat table, in the same transaction, so GET /recipes/stats reads a
+handful of rows instead of running GROUP BYs over the recipe table:
+
+- ('recipes', '')             every recipe
+- ('created', 'YYYY-MM-DD')   the recipes created that day
+- ('published', '')           the published recipes
+- ('cook_time', '')           the published recipes with a cook_time, total is the sum of their cook_time
+- ('servings', '<n>')         the published recipes for n servings
+- ('author', '<user_id>')     the published recipes of the user
+
+A counter written by every recipe is split in STATS_SHARDS rows, the one of a
+recipe is its id modulo STATS_SHARDS, and the reads add them up. The row locks
+are held until the commit at the end of the request, so the concurrent writes
+of different recipes mostly lock different rows. The counters of an author are
+only written by their own recipes, they stay in shard 0.
+
+A deleted recipe takes its contribution back, so the counters are always the
+GROUP BY of the existing recipes. 'flask data rebuild-stats' computes them
+again from the recipe table, after a bulk load or a change of the rules.
+"""
+
+# Import the necessary package and module
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import SmallInteger, String, cast, func, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+
+from extensions import db
+from models.user import User
+
+# Columns of the recipe the statistics depend on
+STATS_COLUMNS = ('id', 'is_publish', 'cook_time', 'num_of_servings', 'user_id', 'created_at')
+
+
+def stat_values(source, prefix=''):
+    """Function to get the STATS_COLUMNS of a recipe or of a returned row, from the
+    <prefix><column> attributes, e.g. 'previous_' for the row before an update"""
+    return {name: getattr(source, prefix + name) for name in STATS_COLUMNS}
+
+
+def contributions(values, shards):
+    """Function to get the (metric, bucket, shard, total) counters a recipe counts in"""
+    shard = values['id'] % shards
+
+    yield 'recipes', '', shard, 0
+
+    if values['created_at'] is not None:
+        yield 'created', values['created_at'].date().isoformat(), shard, 0
+
+    if not values['is_publish']:
+        return
+
+    yield 'published', '', shard, 0
+
+    if values['cook_time'] is not None:
+        yield 'cook_time', '', shard, values['cook_time']
+
+    if values['num_of_servings'] is not None:
+        yield 'servings', str(values['num_of_servings']), shard, 0
+
+    if values['user_id'] is not None:
+        yield 'author', str(values['user_id']), 0, 0
+
+
+class RecipeStat(db.Model):
+    __tablename__ = 'recipe_stat'
+
+    # Define our RecipeStat model, a shard of the counter of the recipes in a bucket of a metric
+    metric = db.Column(db.String(20), primary_key=True)
+    bucket = db.Column(db.String(40), primary_key=True)
+    shard = db.Column(db.SmallInteger(), primary_key=True, default=0)
+    count = db.Column(db.BigInteger(), nullable=False, default=0)
+    total = db.Column(db.BigInteger(), nullable=False, default=0)
+
+    # The top authors are read in count order
+    __table_args__ = (db.Index('ix_recipe_stat_metric_count', 'metric', 'count'), )
+
+    @classmethod
+    def change(cls, before=None, after=None):
+        """This method moves the contribution of a recipe from its stat_values() before a write
+        to the ones after it, in the current transaction: before is None for a new recipe,
+        after is None for a deleted one. The caller commits"""
+        shards = current_app.config['STATS_SHARDS']
+        deltas = {}
+
+        for values, sign in ((before, -1), (after, 1)):
+            for metric, bucket, shard, total in contributions(values, shards) if values is not None else ():
+                delta = deltas.setdefault((metric, bucket, shard), [0, 0])
+                delta[0] += sign
+                delta[1] += sign * total
+
+        # The counters are locked in the same order by every transaction, so they cannot deadlock
+        rows = [{'metric': metric, 'bucket': bucket, 'shard': shard, 'count': count, 'total': total}
+                for (metric, bucket, shard), (count, total) in sorted(deltas.items()) if count or total]
+
+        if not rows:
+            return
+
+        table = cls.__table__
+        statement = insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.metric, table.c.bucket, table.c.shard],
+            set_={'count': table.c.count + statement.excluded.count,
+                  'total': table.c.total + statement.excluded.total})
+
+        db.session.execute(statement)
+
+    @classmethod
+    def rebuild(cls):
+        """This method computes every counter again from the recipe table, in one transaction.
+        The writes of the recipes wait for it, the reads of the statistics do not.
+        Returns the number of counters"""
+        from models.recipe import Recipe
+
+        recipe = Recipe.__table__
+        published = recipe.c.is_publish.is_(True)
+        shard = cast(recipe.c.id % current_app.config['STATS_SHARDS'], SmallInteger).label('shard')
+        count = func.count().label('count')
+        zero = literal(0, db.BigInteger).label('total')
+
+        def counters(metric, bucket=None, where=None, total=zero, sharded=True):
+            """Function to select the counters of a metric, grouped by bucket and shard"""
+            label = literal('') if bucket is None else cast(bucket, String)
+            columns = [label.label('bucket'), shard if sharded else literal(0, SmallInteger).label('shard')]
+            statement = select([literal(metric).label('metric')] + columns + [count, total])
+            statement = statement.select_from(recipe)
+
+            if where is not None:
+                statement = statement.where(where)
+
+            # Only the columns of the recipe are grouped on, PostgreSQL refuses a constant in GROUP BY
+            grouped = (bucket is not None, sharded)
+
+            return statement.group_by(*[column for column, group in zip(columns, grouped) if group])
+
+        statement = union_all(
+            counters('recipes'),
+            counters('created', func.to_char(recipe.c.created_at, 'YYYY-MM-DD')),
+            counters('published', where=published),
+            counters('cook_time', where=published & recipe.c.cook_time.isnot(None),
+                     total=func.sum(recipe.c.cook_time).label('total')),
+            counters('servings', recipe.c.num_of_servings, where=published & recipe.c.num_of_servings.isnot(None)),
+            counters('author', recipe.c.user_id, where=published & recipe.c.user_id.isnot(None), sharded=False))
+
+        # Lock out the writes of the counters first, so none of them is counted twice or lost
+        db.session.execute('LOCK TABLE recipe_stat IN EXCLUSIVE MODE')
+        db.session.execute(cls.__table__.delete())
+        rows = db.session.execute(cls.__table__.insert().from_select(
+            ['metric', 'bucket', 'shard', 'count', 'total'], statement)).rowcount
+        db.session.commit()
+
+        return rows
+
+    @classmethod
+    def get_summary(cls, days, top):
+        """This method reads the statistics of the recipes from the counters: the totals, the
+        average cook_time, the histogram of the servings, the recipes created on each of the
+        last days and the top authors by published recipes"""
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+
+        # The shards of every counter are added up
+        counters = db.session.query(
+            cls.metric, cls.bucket, func.sum(cls.count).label('count'), func.sum(cls.total).label('total')
+        ).filter(
+            (cls.bucket == '') & cls.metric.in_(('recipes', 'published', 'cook_time'))
+            | (cls.metric == 'servings')
+            | (cls.metric == 'created') & (cls.bucket >= since.isoformat())
+        ).group_by(cls.metric, cls.bucket).all()
+
+        totals = {counter.metric: counter for counter in counters if counter.bucket == ''}
+        servings = sorted((int(counter.bucket), counter.count)
+                          for counter in counters if counter.metric == 'servings' and counter.count > 0)
+        created = {counter.bucket: counter.count for counter in counters if counter.metric == 'created'}
+
+        authors = cls.query.filter(cls.metric == 'author', cls.count > 0).order_by(
+            cls.count.desc()).limit(top).all()
+        usernames = dict(db.session.query(User.id, User.username).filter(
+            User.id.in_([int(author.bucket) for author in authors]))) if authors else {}
+
+        cook_time = totals.get('cook_time')
+
+        return {
+            'recipes': int(totals['recipes'].count) if 'recipes' in totals else 0,
+            'published': int(totals['published'].count) if 'published' in totals else 0,
+            'average_cook_time': round(float(cook_time.total) / float(cook_time.count), 1)
+            if cook_time and cook_time.count else None,
+            'num_of_servings': [{'num_of_servings': value, 'count': int(count)} for value, count in servings],
+            'created': [{'date': day.isoformat(), 'count': int(created.get(day.isoformat(), 0))}
+                        for day in (since + timedelta(days=offset) for offset in range(days))],
+            'top_authors': [{'username': usernames.get(int(author.bucket)), 'count': author.count}
+                            for author in authors],
+        }
@@ -0,0 +1,29 @@
+# models/tombstone.py file
+
+# Import the necessary package and module
+from extensions import db
+
+
+class RecipeTombstone(db.Model):
+    __tablename__ = 'recipe_tombstone'
+
+    # Define our RecipeTombstone model, the trace of a deleted recipe for the sync clients
+    recipe_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer())
+    deleted_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.clock_timestamp())
+
+    # The changes are read in (deleted_at, recipe_id) order
+    __table_args__ = (db.Index('ix_recipe_tombstone_deleted_at_recipe_id', 'deleted_at', 'recipe_id'), )
+
+    @classmethod
+    def record(cls, recipe_id, user_id):
+        """This method writes the tombstone of a recipe in the current transaction. The caller commits"""
+        db.session.execute(cls.__table__.insert().values(recipe_id=recipe_id, user_id=user_id))
+
+    @classmethod
+    def prune(cls, before):
+        """This method deletes the tombstones older than before, returns how many"""
+        count = db.session.execute(cls.__table__.delete().where(cls.deleted_at < before)).rowcount
+        db.session.commit()
+
+        return count
@@ -1,5 +1,15 @@
 # models/user.py file
+from flask import current_app
+from sqlalchemy import inspect, or_
+
+from caching import LRUCache
 from extensions import db
+from transactions import after_commit, commit
+
+# Ids of the most recently requested usernames, in every worker. User.save() drops the
+# old and the new username of a rename, the entries expire for the deleted users and
+# the renames of the other workers
+user_ids = LRUCache(maxsize=10000)
 
 
 class User(db.Model):
@@ -17,11 +27,43 @@ class User(db.Model):
 
     recipes = db.relationship('Recipe', backref='user')
 
+    # Fetch created_at and updated_at with the RETURNING of the INSERT and the UPDATE
+    __mapper_args__ = {'eager_defaults': True}
+
     @classmethod
     def get_by_username(cls, username):
         """This method searching the user by username"""
         return cls.query.filter_by(username=username).first()
 
+    @classmethod
+    def get_id_by_username(cls, username):
+        """This method gets only the id of a user by username, from the cache of the worker when it can"""
+        user_id = user_ids.get(username)
+
+        if user_id is None:
+            user_id = db.session.query(cls.id).filter_by(username=username).scalar()
+
+            # The unknown usernames are not cached, they may register at any time
+            if user_id is not None:
+                user_ids.set(username, user_id, ttl=current_app.config['USER_ID_CACHE_TTL'])
+
+        return user_id
+
+    @classmethod
+    def get_conflict(cls, username, email):
+        """This method tells which of the username or the email is already used, in a single
+        query, or returns None when both are free"""
+        rows = db.session.query(cls.username, cls.email).filter(
+            or_(cls.username == username, cls.email == email)).all()
+
+        if any(row.username == username for row in rows):
+            return 'username'
+
+        if any(row.email == email for row in rows):
+            return 'email'
+
+        return None
+
     @classmethod
     def get_by_email(cls, email):
         """This method searching the user by email"""
@@ -32,7 +74,53 @@ class User(db.Model):
         """This method get the user object by ID"""
         return cls.query.filter_by(id=id).first()
 
+    @classmethod
+    def activate(cls, email):
+        """This method has got the logic to activate a user account in a single
+        UPDATE ... WHERE email = :email AND is_active IS NOT true statement, with no load.
+
+        Returns True if the account was activated, False if no inactive account matched"""
+        user = cls.__table__
+        statement = user.update().values(is_active=True).where(
+            (user.c.email == email) & user.c.is_active.isnot(True))
+
+        row = db.session.execute(statement.returning(user.c.id)).first()
+
+        if row is None:
+            return False
+
+        from models.recipe import Recipe
+
+        # updated_at changed, so does the snapshot of the author on the recipes
+        Recipe.update_author_snapshot(user_id=row.id)
+        commit()
+
+        return True
+
+    @classmethod
+    def exists_by_email(cls, email):
+        """This method tells if an account uses the email"""
+        return db.session.query(db.session.query(cls.id).filter_by(email=email).exists()).scalar()
+
     def save(self):
-        """This method persist the data to the database"""
+        """This method persist the data to the database, and the new username, avatar and
+        updated_at on the author snapshot of the recipes of the user"""
+        changed = inspect(self).persistent and db.session.is_modified(self)
+
+        # The history is reset by the flush: keep the username replaced by a rename
+        usernames = set(inspect(self).attrs.username.history.deleted) | {self.username}
+
         db.session.add(self)
-        db.session.commit()
\ No newline at end of file
+
+        if changed:
+            from models.recipe import Recipe
+
+            # Flush first, updated_at comes back with the RETURNING of the UPDATE
+            db.session.flush()
+            Recipe.update_author_snapshot(user_id=self.id)
+
+        commit()
+
+        # Once committed, so that a lookup of the old username cannot cache its id again
+        for username in usernames:
+            after_commit(user_ids.delete, username)
\ No newline at end of file
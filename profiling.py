@@ -0,0 +1,210 @@
+# profiling.py file
+"""Sampling profiler of the requests, aggregated per endpoint as collapsed stacks.
+
+SamplingProfiler.init_app() registers request hooks that profile a fraction
+(PROFILER_SAMPLE_RATE) of the requests, and every request carrying the
+PROFILER_HEADER header with the JWT of an admin (ADMIN_USER_IDS). A single
+background thread per worker takes the stack of the profiled requests every
+PROFILER_INTERVAL seconds, the requests themselves are not slowed down by a
+tracing hook; the thread sleeps when no request is profiled.
+
+The stacks are counted per endpoint in the collapsed format of flamegraph.pl
+and speedscope ('frame;frame;frame count' per line). The admins download them
+on PROFILER_URL/<endpoint>, like the metrics they are per worker (the pid is
+in the file name).
+"""
+
+# Import the necessary package and module
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http import HTTPStatus
+
+from flask import Response, current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required, verify_jwt_in_request_optional
+
+
+def is_admin(user_id):
+    """Function to know if a user may profile the requests and download the profiles"""
+    return user_id is not None and user_id in current_app.config['ADMIN_USER_IDS']
+
+
+class SamplingProfiler:
+    """Sample the stacks of the profiled requests from a background thread"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active = {}
+        self._stacks = {}
+        self._labels = {}
+        self._pid = None
+        self.interval = 0.005
+        self.max_stacks = 10000
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """This method registers the request hooks and the routes of the profiles"""
+        if not app.config.get('PROFILER_ENABLED'):
+            return
+
+        self.interval = app.config['PROFILER_INTERVAL']
+        self.max_stacks = app.config['PROFILER_MAX_STACKS']
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+
+        url = app.config['PROFILER_URL'].rstrip('/')
+        app.add_url_rule(url, 'profiles', self.list_profiles)
+        app.add_url_rule(url + '/<endpoint>', 'profile', self.download_profile, methods=['GET', 'DELETE'])
+
+        app.extensions['profiler'] = self
+
+    def _wanted(self):
+        """Tell if the current request is profiled: sampled, or asked for by an admin"""
+        config = current_app.config
+
+        if random.random() < config['PROFILER_SAMPLE_RATE']:
+            return True
+
+        if config['PROFILER_HEADER'] not in request.headers:
+            return False
+
+        # An invalid token only means the request is not profiled, the view still answers 401
+        try:
+            verify_jwt_in_request_optional()
+        except Exception:
+            return False
+
+        return is_admin(get_jwt_identity())
+
+    def _start_request(self):
+        """Start sampling the thread of the request, when it is profiled"""
+        if request.endpoint is None or request.endpoint.startswith('profile') or not self._wanted():
+            return
+
+        self._ensure_sampler()
+        g.profiled = True
+
+        with self._lock:
+            self._active[threading.get_ident()] = [request.endpoint, 0]
+
+        self._wake.set()
+
+    def _stop(self):
+        """Stop sampling the thread of the request, returns the number of samples taken"""
+        with self._lock:
+            entry = self._active.pop(threading.get_ident(), None)
+
+        return entry[1] if entry else 0
+
+    def _finish_request(self, response):
+        if g.get('profiled'):
+            response.headers['X-Profile-Samples'] = str(self._stop())
+
+        return response
+
+    def _teardown_request(self, exception=None):
+        # The after_request hooks do not run when the view raised
+        self._stop()
+
+    def _ensure_sampler(self):
+        """Start the sampling thread in this process, the thread of the Gunicorn master is not forked"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._sample_forever, name='profiler', daemon=True).start()
+
+    def _label(self, code):
+        """Get the label of a function in the stacks: name (file:line)"""
+        label = self._labels.get(code)
+
+        if label is None:
+            filename = code.co_filename
+            parts = filename.replace('\\', '/').rsplit('/', 2)
+            label = self._labels[code] = '{} ({}:{})'.format(
+                code.co_name, '/'.join(parts[-2:]), code.co_firstlineno)
+
+        return label
+
+    def _sample_forever(self):
+        while True:
+            self._wake.clear()
+
+            with self._lock:
+                active = list(self._active.items())
+
+            if not active:
+                self._wake.wait()
+                continue
+
+            frames = sys._current_frames()
+
+            for ident, entry in active:
+                frame = frames.get(ident)
+                labels = []
+
+                while frame is not None:
+                    labels.append(self._label(frame.f_code))
+                    frame = frame.f_back
+
+                if labels:
+                    self._add(entry, ';'.join(reversed(labels)))
+
+            del frames
+            time.sleep(self.interval)
+
+    def _add(self, entry, stack):
+        """Count a stack of an endpoint, past max_stacks distinct stacks the new ones are merged"""
+        with self._lock:
+            stacks = self._stacks.setdefault(entry[0], Counter())
+
+            if stack not in stacks and len(stacks) >= self.max_stacks:
+                stack = '[other stacks]'
+
+            stacks[stack] += 1
+            entry[1] += 1
+
+    def collapsed(self, endpoint):
+        """This method returns the collapsed stacks of an endpoint, one 'stack count' per line"""
+        with self._lock:
+            stacks = list(self._stacks.get(endpoint, Counter()).items())
+
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(stacks))
+
+    @jwt_required
+    def list_profiles(self):
+        """View function of the list of the profiled endpoints of this worker"""
+        if not is_admin(get_jwt_identity()):
+            return jsonify(message='Access is not allowed'), HTTPStatus.FORBIDDEN
+
+        with self._lock:
+            data = {endpoint: sum(stacks.values()) for endpoint, stacks in self._stacks.items()}
+
+        return jsonify(pid=os.getpid(), interval=self.interval, samples=data)
+
+    @jwt_required
+    def download_profile(self, endpoint):
+        """View function of the collapsed stacks of an endpoint, DELETE starts it again"""
+        if not is_admin(get_jwt_identity()):
+            return jsonify(message='Access is not allowed'), HTTPStatus.FORBIDDEN
+
+        if request.method == 'DELETE':
+            with self._lock:
+                self._stacks.pop(endpoint, None)
+
+            return '', HTTPStatus.NO_CONTENT
+
+        filename = '{}-{}.collapsed'.format(endpoint, os.getpid())
+
+        return Response(self.collapsed(endpoint), mimetype='text/plain',
+                        headers={'Content-Disposition': 'attachment; filename="{}"'.format(filename)})
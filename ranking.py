@@ -0,0 +1,80 @@
+# ranking.py file
+"""Relevance ranking of the search candidates, vectorized with NumPy.
+
+The candidates come from the database with a bit mask of the matches, one bit
+per (term, field): does the name, the description or the ingredients contain the
+term. A single integer column keeps the rows small, the conversion of the rows
+to an array is the costly part. The score of a recipe is
+
+    sum over the terms of the weights of the fields matching the term, divided
+    by the number of terms (so a recipe matching every term ranks first)
+    + RELEVANCE_RECENCY_WEIGHT * 0.5 ** (age in days / RELEVANCE_HALF_LIFE_DAYS)
+    + RELEVANCE_COOK_TIME_WEIGHT * exp(-cook_time / RELEVANCE_COOK_TIME_SCALE)
+
+computed for the whole batch at once, NumPy is imported on first use.
+"""
+
+# Import the necessary package and module
+import re
+
+# Fields of a recipe matched against the terms of the query, in the order of the weights
+RELEVANCE_FIELDS = ('name', 'description', 'ingredients')
+
+# Terms of a query taken into account, the following ones are ignored
+MAX_TERMS = 5
+
+_words = re.compile(r'[^\W_]+')
+
+
+def query_terms(q):
+    """Function to split a query in its distinct lowercase terms"""
+    terms = []
+
+    for term in _words.findall(q.lower()):
+        if term not in terms:
+            terms.append(term)
+
+    return terms[:MAX_TERMS]
+
+
+def match_bit(term_index, field_index):
+    """Function to get the bit of the mask set when the field contains the term"""
+    return 1 << (term_index * len(RELEVANCE_FIELDS) + field_index)
+
+
+def score(masks, terms, created_at, cook_time, now, config):
+    """Function to score a batch of candidates.
+
+    masks holds the match bits of the candidates for the given number of terms,
+    created_at the creation times in seconds since the epoch and cook_time the
+    cook times in minutes, NaN when unknown. Returns the array of the scores"""
+    import numpy as np
+
+    field_weights = np.array([config['RELEVANCE_FIELD_WEIGHTS'][field] for field in RELEVANCE_FIELDS],
+                             dtype=np.float32)
+    scores = np.zeros(len(created_at), dtype=np.float32)
+
+    if terms:
+        bits = np.arange(terms * len(RELEVANCE_FIELDS), dtype=np.int64)
+        matches = ((masks.astype(np.int64)[:, None] >> bits) & 1).astype(np.float32)
+        per_term = matches.reshape(len(masks), terms, len(RELEVANCE_FIELDS)) @ field_weights
+        scores += per_term.sum(axis=1) / terms
+
+    age_days = np.maximum(now - created_at, 0) / 86400
+    scores += config['RELEVANCE_RECENCY_WEIGHT'] * np.exp2(-age_days / config['RELEVANCE_HALF_LIFE_DAYS'])
+
+    preference = np.exp(-np.nan_to_num(cook_time, nan=np.inf) / config['RELEVANCE_COOK_TIME_SCALE'])
+    scores += config['RELEVANCE_COOK_TIME_WEIGHT'] * preference
+
+    return scores
+
+
+def rank(ids, masks, terms, created_at, cook_time, now, config, order='desc'):
+    """Function to sort the candidate ids by score, the best first (or last with order 'asc').
+    Ties keep the order of the candidates"""
+    import numpy as np
+
+    scores = score(masks, terms, created_at, cook_time, now, config)
+    positions = np.argsort(scores if order == 'asc' else -scores, kind='stable')
+
+    return np.asarray(ids)[positions]
@@ -1,8 +1,8 @@
 # resources/recipe.py file
 
 # Import the necessary package and module
-import os
-from flask import request
+from datetime import datetime, timedelta
+from flask import current_app, request
 from flask_restful import Resource
 from flask_jwt_extended import get_jwt_identity, jwt_required, jwt_optional
 from http import HTTPStatus
@@ -11,11 +11,17 @@ from webargs import fields
 from webargs.flaskparser import use_kwargs
 
 from models.recipe import Recipe
+from models.stats import RecipeStat
 from schemas.recipe import RecipeSchema, RecipePaginationSchema
 
-from extensions import image_set, cache, limiter
+from extensions import image_set, limiter
 
-from utils import save_image, clear_cache
+from caching import cached_feed
+from feeds import latest_feeds
+from search import recipe_suggestions
+from summaries import SUMMARY_COLUMNS, recipe_summaries
+from transactions import after_commit
+from utils import save_image, remove_image, validate_image, upload_too_large, clear_cache, make_etag, parse_etag, make_cursor, parse_cursor
 
 # Instantiated and serialize an object
 recipe_schema = RecipeSchema()
@@ -33,6 +39,85 @@ pages = {
     'order': fields.Str(missing='desc')
 }
 
+# Filters of the recipe list, served by the recipe_ingredient and the range indexes:
+# ?include=almonds,honey&exclude=eggs&max_cook_time=30&facets=true
+filters = {
+    'include': fields.DelimitedList(fields.Str(), missing=[]),
+    'exclude': fields.DelimitedList(fields.Str(), missing=[]),
+    'min_cook_time': fields.Int(missing=None),
+    'max_cook_time': fields.Int(missing=None),
+    'min_servings': fields.Int(missing=None),
+    'max_servings': fields.Int(missing=None),
+    'facets': fields.Bool(missing=False)
+}
+
+
+# Query arguments of the change feed
+changes = {
+    'cursor': fields.Str(missing=None),
+    'limit': fields.Int(missing=100)
+}
+
+# Query arguments of the suggestions
+suggestions = {
+    'q': fields.Str(missing=''),
+    'limit': fields.Int(missing=10)
+}
+
+
+# Query arguments of the statistics
+stats = {
+    'days': fields.Int(missing=None),
+    'top': fields.Int(missing=None)
+}
+
+
+# Columns returned by the writes of a recipe, for the in-memory indexes and the feeds
+RECIPE_EVENT_COLUMNS = SUMMARY_COLUMNS + ('name', 'user_id', 'ingredients', 'is_publish')
+
+
+def recipe_published(recipe):
+    """Function to add a newly published recipe to the in-memory indexes of this worker and to
+    the materialized feeds. The other workers pick it up on their next refresh"""
+    recipe_suggestions.publish(recipe.id, recipe.name, recipe.ingredients)
+    recipe_summaries.publish(recipe)
+    latest_feeds.publish(recipe.id, recipe.user_id, recipe.created_at)
+
+
+def recipe_updated(recipe):
+    """Function to update the in-memory indexes of this worker after the edit of a published recipe"""
+    if recipe.is_publish:
+        recipe_suggestions.publish(recipe.id, recipe.name, recipe.ingredients)
+        recipe_summaries.publish(recipe)
+
+
+def recipe_unpublished(recipe_id, user_id):
+    """Function to remove an unpublished or deleted recipe from the in-memory indexes and the feeds"""
+    recipe_suggestions.unpublish(recipe_id)
+    recipe_summaries.unpublish(recipe_id)
+    latest_feeds.unpublish(recipe_id, user_id)
+
+
+def write_denied(recipe_id, current_user, unchanged=None):
+    """Function to tell why a write on a recipe, filtered by its owner, matched no row.
+
+    It only reads the owner and the version of the recipe: 404 if it does not exist,
+    403 if it belongs to another user, 412 if it was modified since the client read it.
+    For a write with changed_only, a recipe of the user already had the values, the
+    unchanged response is returned"""
+    owner = Recipe.get_owner_and_version(recipe_id=recipe_id)
+
+    if owner is None:
+        return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
+
+    if current_user != owner.user_id:
+        return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
+
+    if unchanged is not None:
+        return unchanged
+
+    return {'message': 'Recipe has been modified'}, HTTPStatus.PRECONDITION_FAILED
+
 
 class RecipeListResource(Resource):
 
@@ -40,22 +125,44 @@ class RecipeListResource(Resource):
     decorators = [limiter.limit('3/minute; 30/hour; 300/day', methods=['GET'], error_message='Too Many Requests')]
 
     @use_kwargs(pages)
-    @cache.cached(timeout=60, query_string=True)
-    def get(self, q, page, per_page, sort, order):
-        """This method have the logic to retrieve
-         all recipes, paginate, sort results and search for recipes"""
-
-        # Accept only the created_at, cook_time, and num_of_servings values
-        if sort not in ['created_at', 'cook_time', 'num_of_servings']:
+    @use_kwargs(filters)
+    @cached_feed()
+    def get(self, q, page, per_page, sort, order, facets, **recipe_filters):
+        """This method have the logic to retrieve all recipes, paginate, sort results,
+        search for recipes, filter them by ingredient, cook time and servings, and count
+        the matching recipes per facet"""
+
+        # Accept only the created_at, cook_time, num_of_servings, similarity and relevance values
+        if sort not in ['created_at', 'cook_time', 'num_of_servings', 'similarity', 'relevance']:
             sort = 'created_at'
 
         # Accept only the asc and desc values
         if order not in ['asc', 'desc']:
             order = 'desc'
 
-        paginated_recipes = Recipe.get_all_published(q, page, per_page, sort, order)
+        paginated_recipes = None
 
-        return recipe_pagination_schema.dump(paginated_recipes).data, HTTPStatus.OK
+        # Without search nor filters, the page comes from the summary store when it is enabled,
+        # and the newest recipes first from the materialized global feed otherwise
+        if not q and not any(recipe_filters.values()):
+            config = current_app.config
+
+            # The store has no relevance order, sort=relevance without q is left to get_all_published()
+            if config['SUMMARY_STORE_ENABLED'] and sort != 'relevance':
+                paginated_recipes = recipe_summaries.paginate(
+                    'created_at' if sort == 'similarity' else sort, order, page, per_page,
+                    refresh=config['SUMMARY_STORE_REFRESH'])
+            elif sort == 'created_at' and order == 'desc':
+                paginated_recipes = latest_feeds.paginate(None, page, per_page)
+
+        if paginated_recipes is None:
+            paginated_recipes = Recipe.get_all_published(q, page, per_page, sort, order, recipe_filters)
+        data = recipe_pagination_schema.dump(paginated_recipes).data
+
+        if facets:
+            data['facets'] = Recipe.get_facets(q, recipe_filters, limit=current_app.config['INGREDIENT_FACET_LIMIT'])
+
+        return data, HTTPStatus.OK
 
     @jwt_required
     def post(self):
@@ -80,6 +187,98 @@ class RecipeListResource(Resource):
         return recipe_schema.dump(recipe).data, HTTPStatus.CREATED
 
 
+class RecipeSuggestionResource(Resource):
+
+    # A typeahead sends a request per keystroke, it gets its own rate limit instead of the one of the list
+    decorators = [limiter.limit('10/second; 600/minute', methods=['GET'], error_message='Too Many Requests')]
+
+    @use_kwargs(suggestions)
+    def get(self, q, limit):
+        """This method has got the logic to suggest the names of the published recipes and the
+        ingredients starting with q, from the in-memory prefix indexes"""
+        config = current_app.config
+        limit = max(1, min(limit, config['SUGGESTIONS_MAX_LIMIT']))
+
+        names, ingredients = recipe_suggestions.get(refresh=config['SUGGESTIONS_REFRESH'])
+
+        # Nothing is suggested until the indexes of the worker are first built
+        data = {
+            'recipes': names.suggest(q, limit=limit) if names is not None else [],
+            'ingredients': ingredients.suggest(q, limit=limit) if ingredients is not None else []
+        }
+
+        return data, HTTPStatus.OK, {'Cache-Control': 'public, max-age={}'.format(config['SUGGESTIONS_MAX_AGE'])}
+
+
+class RecipeStatsResource(Resource):
+
+    @use_kwargs(stats)
+    def get(self, days, top):
+        """This method has got the logic to return the statistics of the recipes: the totals, the
+        average cook time, the histogram of the servings, the new recipes of the last days and
+        the top authors. They are read from the counters kept up to date by the writes, not
+        computed from the recipes"""
+        config = current_app.config
+        days = max(1, min(days or config['STATS_DAYS'], config['STATS_MAX_DAYS']))
+        top = max(1, min(top or config['STATS_TOP_AUTHORS'], config['STATS_MAX_TOP_AUTHORS']))
+
+        data = RecipeStat.get_summary(days=days, top=top)
+
+        return data, HTTPStatus.OK, {'Cache-Control': 'public, max-age={}'.format(config['STATS_MAX_AGE'])}
+
+
+class RecipeChangeListResource(Resource):
+
+    @use_kwargs(changes)
+    def get(self, cursor, limit):
+        """This method has got the logic to return the recipes published, updated, unpublished or
+        deleted since the cursor, so the clients only download the changes of the catalogue.
+
+        Without a cursor it starts from the beginning. Every response holds the cursor of the
+        next call and has_more, true when the client should call again right away"""
+        config = current_app.config
+        limit = max(1, min(limit, config['SYNC_MAX_BATCH']))
+
+        if cursor is not None:
+            cursor = parse_cursor(cursor)
+
+            if cursor is None:
+                return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
+
+            # The tombstones are pruned, an older cursor could miss deletions
+            if cursor[0] < datetime.utcnow() - timedelta(days=config['SYNC_TOMBSTONE_RETENTION_DAYS']):
+                return {'message': 'Cursor expired, sync again from the start'}, HTTPStatus.GONE
+
+        rows = Recipe.get_changes(cursor=cursor, limit=limit, lag=config['SYNC_SAFETY_LAG'])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # The content of the published recipes, in one query
+        updated = [row.id for row in rows if row.kind == Recipe.CHANGE_UPDATED]
+        recipes = {recipe.id: recipe for recipe in Recipe.get_by_ids(updated)}
+
+        data = []
+
+        for row in rows:
+            recipe = recipes.get(row.id)
+
+            if row.kind == Recipe.CHANGE_DELETED:
+                data.append({'id': row.id, 'change': 'deleted'})
+            elif recipe is not None and recipe.is_publish:
+                data.append({'id': row.id, 'change': 'published', 'recipe': recipe_schema.dump(recipe).data})
+            else:
+                # Unpublished, or deleted since the changes were read: the clients drop it either way
+                data.append({'id': row.id, 'change': 'unpublished'})
+
+        if rows:
+            last = rows[-1]
+            cursor = make_cursor(last.changed_at, last.kind, last.id)
+        elif cursor is not None:
+            cursor = make_cursor(*cursor)
+
+        return {'data': data, 'cursor': cursor, 'has_more': has_more}, HTTPStatus.OK
+
+
 class RecipeResource(Resource):
     @jwt_optional
     def get(self, recipe_id):
@@ -97,7 +296,7 @@ class RecipeResource(Resource):
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
         # Finally, return the recipe in a JSON format and with status code HTTP 200 OK
-        return recipe_schema.dump(recipe).data, HTTPStatus.OK
+        return recipe_schema.dump(recipe).data, HTTPStatus.OK, {'ETag': make_etag(recipe.updated_at)}
 
     @jwt_required
     def patch(self, recipe_id):
@@ -108,52 +307,56 @@ class RecipeResource(Resource):
         if errors:
             return {'message': 'Validation errors', 'errors': errors}, HTTPStatus.BAD_REQUEST
 
-        recipe = Recipe.get_by_id(recipe_id=recipe_id)
+        current_user = get_jwt_identity()
 
-        # Check whether the recipe exists and whether the user has update privileges
-        if recipe is None:
-            return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
+        # Optimistic concurrency: with an If-Match header, only the version the client has seen is updated
+        version = None
+        if_match = request.headers.get('If-Match')
 
-        current_user = get_jwt_identity()
+        if if_match and if_match.strip() != '*':
+            version = parse_etag(if_match)
 
-        if current_user != recipe.user_id:
-            return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
+            if version is None:
+                return {'message': 'Recipe has been modified'}, HTTPStatus.PRECONDITION_FAILED
 
-        # Update the recipe details and then save them in the database
-        recipe.name = data.get('name') or recipe.name
-        recipe.description = data.get('description') or recipe.description
-        recipe.num_of_servings = data.get('num_of_servings') or recipe.num_of_servings
-        recipe.cook_time = data.get('cook_time') or recipe.cook_time
-        recipe.ingredients = data.get('ingredients') or recipe.ingredients
-        recipe.directions = data.get('directions') or recipe.directions
+        # Update only the fields sent by the client, the owner is checked by the same statement
+        recipe = Recipe.update_by_owner(recipe_id=recipe_id, user_id=current_user, values=data, version=version)
 
-        recipe.save()
+        # Nothing was updated, find out whether the recipe exists, whether the user has update
+        # privileges, or whether it has been modified since the client read it
+        if recipe is None:
+            return write_denied(recipe_id, current_user)
+
+        # Update the in-memory indexes of this worker with the new values, once committed
+        after_commit(recipe_updated, recipe)
 
         # Clear cache
-        clear_cache('/recipes')
+        after_commit(clear_cache, '/recipes')
 
         # Finally, return the recipe in a JSON format and with status code HTTP 200 OK
-        return recipe_schema.dump(recipe).data, HTTPStatus.OK
+        return recipe_schema.dump(recipe).data, HTTPStatus.OK, {'ETag': make_etag(recipe.updated_at)}
 
     @jwt_required
     def delete(self, recipe_id):
         """This method has the logic to delete a recipe that has been published"""
-        recipe = Recipe.get_by_id(recipe_id=recipe_id)
+        current_user = get_jwt_identity()
 
-        # Check whether the recipe exists and whether the user has privileges to delete it
-        if recipe is None:
-            return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
+        # Delete the recipe in a single statement that also checks the user has privileges to delete it
+        recipe = Recipe.delete_owned(
+            recipe_id=recipe_id, user_id=current_user, returning=('id', 'is_publish', 'cover_image'))
 
-        current_user = get_jwt_identity()
+        if recipe is None:
+            return write_denied(recipe_id, current_user)
 
-        if current_user != recipe.user_id:
-            return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
+        if recipe.is_publish:
+            after_commit(recipe_unpublished, recipe_id, current_user)
 
-        # Delete recipe
-        recipe.delete()
+        # The cover is removed once the deletion is committed
+        if recipe.cover_image:
+            after_commit(remove_image, folder='recipes', filename=recipe.cover_image)
 
         # Clear cache
-        clear_cache('/recipes')
+        after_commit(clear_cache, '/recipes')
 
         # And return an empty JSON with status code HTTP NO_CONTENT
         return {}, HTTPStatus.NO_CONTENT
@@ -164,22 +367,21 @@ class RecipePublishResource(Resource):
     @jwt_required
     def put(self, recipe_id):
         """This method has got the logic to publish a recipe"""
-        recipe = Recipe.get_by_id(recipe_id=recipe_id)
-
-        if recipe is None:
-            return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
-
         # Only users who have logged in can publish their own recipes
         current_user = get_jwt_identity()
 
-        if current_user != recipe.user_id:
-            return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
+        # A published recipe is left as it is: its updated_at, its ETag and the change feed do not move
+        recipe = Recipe.update_owned(
+            recipe_id=recipe_id, user_id=current_user, values={'is_publish': True},
+            returning=RECIPE_EVENT_COLUMNS, changed_only=True)
 
-        recipe.is_publish = True
-        recipe.save()
+        if recipe is None:
+            return write_denied(recipe_id, current_user, unchanged=({}, HTTPStatus.NO_CONTENT))
+
+        after_commit(recipe_published, recipe)
 
         # Clear cache
-        clear_cache('/recipes')
+        after_commit(clear_cache, '/recipes')
 
         # And return an empty JSON with status code HTTP NO_CONTENT
         return {}, HTTPStatus.NO_CONTENT
@@ -187,22 +389,20 @@ class RecipePublishResource(Resource):
     @jwt_required
     def delete(self, recipe_id):
         """This method has got the logic to unpublish a previously published recipe."""
-        recipe = Recipe.get_by_id(recipe_id=recipe_id)
-
-        if recipe is None:
-            return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
-
         # Only an authenticated user can unpublished the recipe
         current_user = get_jwt_identity()
 
-        if current_user != recipe.user_id:
-            return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
+        # Same for a recipe that is not published
+        recipe = Recipe.update_owned(
+            recipe_id=recipe_id, user_id=current_user, values={'is_publish': False}, changed_only=True)
 
-        recipe.is_publish = False
-        recipe.save()
+        if recipe is None:
+            return write_denied(recipe_id, current_user, unchanged=({}, HTTPStatus.NO_CONTENT))
+
+        after_commit(recipe_unpublished, recipe_id, current_user)
 
         # Clear cache
-        clear_cache('/recipes')
+        after_commit(clear_cache, '/recipes')
 
         # And return an empty JSON with status code HTTP NO_CONTENT
         return {}, HTTPStatus.NO_CONTENT
@@ -213,6 +413,10 @@ class RecipeCoverUploadResource(Resource):
     @jwt_required
     def put(self, recipe_id):
         """This method has got the logic to put the cover image of the recipe."""
+        # Reject the bodies over the limit before they are read
+        if upload_too_large(current_app.config['UPLOAD_MAX_COVER_SIZE']):
+            return {'message': 'File is too large'}, HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
         file = request.files.get('cover')
 
         # Check if cover image exists and whether the file extension is permitted
@@ -222,34 +426,44 @@ class RecipeCoverUploadResource(Resource):
         if not image_set.file_allowed(file, file.filename):
             return {'message': 'File type not allowed'}, HTTPStatus.BAD_REQUEST
 
-        # Retrieved the Recipe object
-        recipe = Recipe.get_by_id(recipe_id=recipe_id)
+        current_user = get_jwt_identity()
 
-        if recipe is None:
-            return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
+        # Only the owner of an existing recipe gets the image decoded and stored
+        owner = Recipe.get_owner_and_version(recipe_id=recipe_id)
 
-        # Check right to modify the recipe
-        current_user = get_jwt_identity()
+        if owner is None:
+            return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
 
-        if current_user != recipe.user_id:
+        if current_user != owner.user_id:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
-        if recipe.cover_image:
-            cover_path = image_set.path(folder='recipes', filename=recipe.cover_image)
+        # Check the content of the file from its first bytes and its header
+        error = validate_image(file)
 
-            if os.path.exists(cover_path):
-                os.remove(cover_path)
+        if error:
+            return {'message': error}, HTTPStatus.BAD_REQUEST
 
         # Save the uploaded image
         filename = save_image(image=file, folder='recipes')
 
-        recipe.cover_image = filename
+        # Store it in the recipe, still only if the user owns it, and get back the previous cover
+        recipe = Recipe.update_owned(
+            recipe_id=recipe_id, user_id=current_user, values={'cover_image': filename},
+            returning=RECIPE_EVENT_COLUMNS, previous=('cover_image',))
 
-        # Save the recipe
-        recipe.save()
+        if recipe is None:
+            remove_image(folder='recipes', filename=filename)
+
+            return write_denied(recipe_id, current_user)
+
+        # The previous cover is removed once the new one is committed
+        if recipe.previous_cover_image:
+            after_commit(remove_image, folder='recipes', filename=recipe.previous_cover_image)
+
+        after_commit(recipe_updated, recipe)
 
         # Clear cache
-        clear_cache('/recipes')
+        after_commit(clear_cache, '/recipes')
 
         # Finally, return the URL image in a JSON format and with status code HTTP 200 OK
         return recipe_cover_schema.dump(recipe).data, HTTPStatus.OK
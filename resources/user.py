@@ -2,12 +2,16 @@
 
 # Import the necessary package and module
 import os
-from flask import request, url_for, render_template
+from functools import lru_cache
+from flask import current_app, request, url_for, render_template
 from flask_restful import Resource
 from flask_jwt_extended import jwt_optional, get_jwt_identity, jwt_required
 from http import HTTPStatus
 
-from extensions import image_set, limiter
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db, image_set, limiter
+from feeds import latest_feeds
 
 from mailgun import MailgunApi
 from models.user import User
@@ -16,7 +20,11 @@ from models.recipe import Recipe
 from schemas.recipe import RecipeSchema, RecipePaginationSchema
 from schemas.user import UserSchema
 
-from utils import generate_token, verify_token, save_image, clear_cache
+from transactions import after_commit
+from utils import (
+    generate_token, verify_token, is_token_used, mark_token_used,
+    save_image, remove_image, remove_image_later, validate_image, upload_too_large, clear_cache
+)
 
 from webargs import fields
 from webargs.flaskparser import use_kwargs
@@ -27,12 +35,37 @@ user_public_schema = UserSchema(exclude=('email',))
 recipe_list_schema = RecipeSchema(many=True)
 recipe_pagination_schema = RecipePaginationSchema()
 
-# This data is stored in the environment variable. First, you should ensure of
-# creating an account with Mailgun, then generate the API_KEY and API_URL,
-# and add both to the environment variable.
-mailgun = MailgunApi(
-    domain=os.environ.get('MAILGUN_DOMAIN'),
-    api_key=os.environ.get('MAILGUN_API_KEY'))
+
+@lru_cache(maxsize=None)
+def get_mailgun():
+    """Function to build the Mailgun client on first use instead of at import.
+
+    This data is stored in the environment variable. First, you should ensure of
+    creating an account with Mailgun, then generate the API_KEY and API_URL,
+    and add both to the environment variable."""
+    return MailgunApi(
+        domain=os.environ.get('MAILGUN_DOMAIN'),
+        api_key=os.environ.get('MAILGUN_API_KEY'))
+
+
+def send_activation_email(email):
+    """Function to send the link to activate the user account"""
+    # Generate a token to activate the user account
+    token = generate_token(email, salt='activate')
+    subject = 'Please confirm your registration.'
+
+    # Create the activation link and message to activate account
+    link = url_for('useractivateresource', token=token, _external=True)
+    text = 'Hi, Thanks for using DessertRecipe! Please confirm your registration\
+    by clicking on the link: {}'.format(link)
+
+    # Send the email
+    get_mailgun().send_email(
+        to=email,
+        subject=subject,
+        text=text,
+        html=render_template('email/send-activation.html', link=link))
+
 
 # Create a dictionary for API pagination. The key-value pairs are passed to the
 # @use_kwargs decorator
@@ -54,33 +87,23 @@ class UserListResource(Resource):
         if errors:
             return {'message': 'Validation errors', 'errors': errors}, HTTPStatus.BAD_REQUEST
 
-        if User.get_by_username(data.get('username')):  # check if user already exists in the database
-            return {'message': 'Username already used'}, HTTPStatus.BAD_REQUEST
-
-        if User.get_by_email(data.get('email')):  # check if email already exists in the database
-            return {'message': 'Email already used'}, HTTPStatus.BAD_REQUEST
-
         # Create a user object
         user = User(**data)
 
-        # Save the user object
-        user.save()
+        # Save the user object. Email and username are unique: instead of checking them first,
+        # the INSERT fails on a duplicate and a single query tells which one is used
+        try:
+            user.save()
+        except IntegrityError:
+            db.session.rollback()
 
-        # Generate a token to activate the user account
-        token = generate_token(user.email, salt='activate')
-        subject = 'Please confirm your registration.'
+            if User.get_conflict(username=data.get('username'), email=data.get('email')) == 'email':
+                return {'message': 'Email already used'}, HTTPStatus.BAD_REQUEST
 
-        # Create the activation link and message to activate account
-        link = url_for('useractivateresource', token=token, _external=True)
-        text = 'Hi, Thanks for using DessertRecipe! Please confirm your registration\
-        by clicking on the link: {}'.format(link)
+            return {'message': 'Username already used'}, HTTPStatus.BAD_REQUEST
 
-        # Send the email
-        mailgun.send_email(
-            to=user.email,
-            subject=subject,
-            text=text,
-            html=render_template('email/send-activation.html', link=link))
+        # Send the activation email once the user is committed
+        after_commit(send_activation_email, user.email)
 
         # Return the user details in JSON format
         return user_schema.dump(user).data, HTTPStatus.CREATED
@@ -124,22 +147,31 @@ class UserRecipeListResource(Resource):
     @use_kwargs(pages)
     def get(self, username, page, per_page, visibility):
         """This method has the logic to retrieve all recipes published by a user."""
-        user = User.get_by_username(username=username)
+        # Only the id of the author is needed, it usually comes from the cache of the worker
+        user_id = User.get_id_by_username(username=username)
 
-        if user is None:
+        if user_id is None:
             return {'message': 'User not found'}, HTTPStatus.NOT_FOUND
 
         current_user = get_jwt_identity()
 
         # If the username is the currently authenticated user, then they can
         # see all the recipes
-        if current_user == user.id and visibility in ['all', 'private']:
+        if current_user == user_id and visibility in ['all', 'private']:
             pass
         else:
             visibility = 'public'
 
+        paginated_recipes = None
+
+        # The published recipes come from the materialized feed of the author
+        if visibility == 'public':
+            paginated_recipes = latest_feeds.paginate(user_id, page, per_page)
+
         # Gets the paginated recipes by a particular author
-        paginated_recipes = Recipe.get_all_by_user(user_id=user.id, page=page, per_page=per_page, visibility=visibility)
+        if paginated_recipes is None:
+            paginated_recipes = Recipe.get_all_by_user(
+                user_id=user_id, page=page, per_page=per_page, visibility=visibility)
 
         # Serialize the paginated object and return HTTP Status Code
         return recipe_pagination_schema.dump(paginated_recipes).data, HTTPStatus.OK
@@ -148,23 +180,26 @@ class UserRecipeListResource(Resource):
 class UserActivateResource(Resource):
     def get(self, token):
         """This method has the logic to verify the token, email and the user account status"""
+        # A token already used is rejected without verifying it nor querying the database
+        if is_token_used(token):
+            return {'message': 'The user account is already activated'}, HTTPStatus.BAD_REQUEST
+
         email = verify_token(token, salt='activate')
 
         if email is False:
             return {'message': 'Invalid token or token expired'}, HTTPStatus.BAD_REQUEST
 
-        user = User.get_by_email(email=email)
+        # Activate the account in a single statement, only if it is not active yet
+        if not User.activate(email=email):
+            if not User.exists_by_email(email=email):
+                return {'message': 'User not found'}, HTTPStatus.NOT_FOUND
 
-        if not user:
-            return {'message': 'User not found'}, HTTPStatus.NOT_FOUND
+            # If the user account is already activated
+            mark_token_used(token)
 
-        # If the user account is already activated
-        if user.is_active is True:
             return {'message': 'The user account is already activated'}, HTTPStatus.BAD_REQUEST
 
-        user.is_active = True
-
-        user.save()
+        after_commit(mark_token_used, token)
 
         # Request was handled successfully
         return {}, HTTPStatus.NO_CONTENT
@@ -174,20 +209,28 @@ class UserAvatarUploadResource(Resource):
     @jwt_required
     def put(self):
         """This method has the logic to put the user avatar image file"""
+        # Reject the bodies over the limit before they are read
+        if upload_too_large(current_app.config['UPLOAD_MAX_AVATAR_SIZE']):
+            return {'message': 'File is too large'}, HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
         file = request.files.get('avatar')
 
         # Validate image
         if not file:
             return {'message': 'Not a valid image'}, HTTPStatus.BAD_REQUEST
 
-        user = User.get_by_id(id=get_jwt_identity())
+        if not image_set.file_allowed(file, file.filename):
+            return {'message': 'File type not allowed'}, HTTPStatus.BAD_REQUEST
 
-        if user.avatar_image:
-            avatar_path = image_set.path(folder='avatar', filename=user.avatar_image)
+        # Check the content of the file from its first bytes and its header
+        error = validate_image(file)
 
-            # Check is avatar exist and removed before we replace it with our uploaded image
-            if os.path.exists(avatar_path):
-                os.remove(avatar_path)
+        if error:
+            return {'message': error}, HTTPStatus.BAD_REQUEST
+
+        user = User.get_by_id(id=get_jwt_identity())
+        config = current_app.config
+        previous_avatar = user.avatar_image
 
         # Save image
         filename = save_image(image=file, folder='avatars')
@@ -195,11 +238,21 @@ class UserAvatarUploadResource(Resource):
         # Store the filename of image withing 'user.avatar_image'
         user.avatar_image = filename
 
-        # Save image update to the database
+        # Save image update to the database, with the author snapshot of the recipes
         user.save()
 
-        # Clear cache
-        clear_cache('/recipes')
+        if config['AUTHOR_SNAPSHOT_ENABLED']:
+            # The cached pages keep the previous avatar until they expire, it is removed after them
+            if previous_avatar:
+                after_commit(remove_image_later, folder='avatars', filename=previous_avatar,
+                             delay=config['FEED_CACHE_HARD_TIMEOUT'])
+        else:
+            # The previous avatar is removed once the new one is committed
+            if previous_avatar:
+                after_commit(remove_image, folder='avatars', filename=previous_avatar)
+
+            # Clear cache
+            after_commit(clear_cache, '/recipes')
 
         # Finally, return the URL image in a JSON format and with status code HTTP 200 OK
         return user_avatar_schema.dump(user).data, HTTPStatus.OK
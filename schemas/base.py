@@ -0,0 +1,24 @@
+# schemas/base.py file
+
+# Import the necessary package and module
+from flask import g, has_request_context
+from marshmallow import Schema
+
+from metrics import timed
+
+
+class InstrumentedSchema(Schema):
+    """Base schema that adds the time spent in dump() to the 'serialization' phase of the request"""
+
+    def dump(self, *args, **kwargs):
+        """This method times only the outermost dump, nested schemas are part of it"""
+        if not has_request_context() or getattr(g, 'metrics_serializing', False):
+            return super().dump(*args, **kwargs)
+
+        g.metrics_serializing = True
+
+        try:
+            with timed('serialization'):
+                return super().dump(*args, **kwargs)
+        finally:
+            g.metrics_serializing = False
@@ -2,11 +2,12 @@
 
 # Import the necessary package and module
 from flask import request
-from marshmallow import Schema, fields
+from marshmallow import fields
+from schemas.base import InstrumentedSchema
 from urllib.parse import urlencode
 
 
-class PaginationSchema(Schema):
+class PaginationSchema(InstrumentedSchema):
 
     class Meta:
         ordered = True
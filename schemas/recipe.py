@@ -2,7 +2,8 @@
 
 # Import the necessary package and module
 from flask import url_for
-from marshmallow import Schema, fields, post_dump, validate, validates, ValidationError
+from marshmallow import fields, post_dump, validate, validates, ValidationError
+from schemas.base import InstrumentedSchema
 from schemas.user import UserSchema
 from schemas.pagination import PaginationSchema
 
@@ -15,7 +16,7 @@ def validate_num_of_servings(number):
         raise ValidationError('Number of servings must not be greater than 50.')
 
 
-class RecipeSchema(Schema):
+class RecipeSchema(InstrumentedSchema):
 
     class Meta:
         ordered = True
@@ -30,7 +31,7 @@ class RecipeSchema(Schema):
     directions = fields.String(validate=[validate.Length(max=1000)])
     cover_url = fields.Method(serialize='dump_cover_url')
     is_publish = fields.Boolean(dump_only=True)
-    author = fields.Nested(UserSchema, attribute='user', dump_only=True, exclude=('email', ))
+    author = fields.Nested(UserSchema, attribute='author', dump_only=True, exclude=('email', ))
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
 
@@ -45,9 +46,9 @@ class RecipeSchema(Schema):
     def dump_cover_url(self, recipe):
         """This method has got the logic to verify the cover image of the recipe."""
         if recipe.cover_image:
-            return url_for('static', filename='images/recipes/{}'.format(recipe.cover_image), _external=True)
+            return url_for('media', filename='recipes/{}'.format(recipe.cover_image), _external=True)
         else:  # set default cover image
-            return url_for('static', filename='images/assets/default-recipe-cover.jpg', _external=True)
+            return url_for('media', filename='assets/default-recipe-cover.jpg', _external=True)
 
 
 class RecipePaginationSchema(PaginationSchema):
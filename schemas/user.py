@@ -2,11 +2,12 @@
 
 # Import the necessary package and module
 from flask import url_for
-from marshmallow import Schema, fields
+from marshmallow import fields
+from schemas.base import InstrumentedSchema
 from utils import hash_password
 
 
-class UserSchema(Schema):
+class UserSchema(InstrumentedSchema):
 
     class Meta:
         ordered = True
@@ -28,11 +29,11 @@ class UserSchema(Schema):
         """This method has got the logic to verify the avatar image of the user."""
         if user.avatar_image:
             return url_for(
-                'static',
-                filename=f'images/avatars/{user.avatar_image}',
+                'media',
+                filename=f'avatars/{user.avatar_image}',
                 _external=True)
         else:  # set default avatar
             return url_for(
-                'static',
-                filename='images/assets/default-avatar.jpg',
+                'media',
+                filename='assets/default-avatar.jpg',
                 _external=True)
\ No newline at end of file
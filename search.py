@@ -0,0 +1,234 @@
+# search.py file
+"""Search of the recipes.
+
+init_trigram_search() sets up the pg_trgm word similarity of the search, so
+"pistach" finds "pistachio" and "chocolte" still finds "chocolate".
+
+PrefixIndex is the sorted array behind the suggestions of the recipe names and
+the ingredients, a prefix is answered with a binary search.
+"""
+
+# Import the necessary package and module
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import event
+
+_words = re.compile(r'[^\W_]+')
+
+
+def init_trigram_search(engine, threshold):
+    """Function to set the cut-off of the pg_trgm %> operator once on every new connection
+    of the engine, instead of a set_config() round trip per search"""
+    if engine.dialect.name != 'postgresql':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_similarity_threshold(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+
+        try:
+            cursor.execute('SET pg_trgm.word_similarity_threshold = %s', (str(threshold), ))
+        finally:
+            cursor.close()
+
+        # Committed, a rollback of the first transaction of the connection would undo the SET
+        dbapi_connection.commit()
+
+
+def normalize_prefix(text):
+    """Function to get the lowercase text with single spaces, as the keys of PrefixIndex"""
+    return ' '.join(_words.findall(text.lower()))
+
+
+class PrefixIndex:
+    """Sorted array of the "key\0text" entries of the suggestions, with the number of
+    documents holding every entry.
+
+    A text is found from the start of every word: "Rich chocolate cake" is stored
+    under "rich chocolate cake", "chocolate cake" and "cake"."""
+
+    def __init__(self, entries=None, documents=None):
+        self._counts = Counter(entries or ())
+        self._entries = sorted(self._counts)
+        self._documents = documents or {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def entries(texts):
+        """This method returns the entries of the texts of a document"""
+        entries = set()
+
+        for text in texts:
+            words = _words.findall(text.lower())
+
+            for i in range(len(words)):
+                entries.add('{}\0{}'.format(' '.join(words[i:]), text))
+
+        return entries
+
+    @classmethod
+    def build(cls, documents):
+        """This method builds the index of the (doc_id, texts) pairs in one sort"""
+        entries = Counter()
+        document_entries = {}
+
+        for doc_id, texts in documents:
+            document_entries[doc_id] = tuple(cls.entries(texts))
+            entries.update(document_entries[doc_id])
+
+        return cls(entries, document_entries)
+
+    def add(self, doc_id, texts):
+        """This method indexes the texts of a document, replacing its previous ones"""
+        self.remove(doc_id)
+        self._documents[doc_id] = tuple(self.entries(texts))
+
+        for entry in self._documents[doc_id]:
+            self._counts[entry] += 1
+
+            if self._counts[entry] == 1:
+                insort(self._entries, entry)
+
+    def remove(self, doc_id):
+        """This method removes the texts of a document"""
+        for entry in self._documents.pop(doc_id, ()):
+            self._counts[entry] -= 1
+
+            if self._counts[entry] <= 0:
+                del self._counts[entry]
+                i = bisect_left(self._entries, entry)
+
+                if i < len(self._entries) and self._entries[i] == entry:
+                    self._entries.pop(i)
+
+    def suggest(self, prefix, limit=10, scan=200):
+        """This method returns the texts starting with the prefix (from the start of any
+        of their words), held by the most documents first. Only the first 'scan' entries
+        after the prefix, in alphabetical order, are ranked, so a one-letter prefix costs
+        the same as a long one. A short prefix matching more entries than that can miss a
+        popular text that sorts after them, it shows up as the prefix gets longer"""
+        prefix = normalize_prefix(prefix)
+
+        if not prefix:
+            return []
+
+        counts = Counter()
+        i = bisect_left(self._entries, prefix)
+
+        for entry in self._entries[i:i + scan]:
+            if not entry.startswith(prefix):
+                break
+
+            text = entry.partition('\0')[2]
+            counts[text] = max(counts[text], self._counts[entry])
+
+        return [text for text, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]]
+
+
+class RecipeSuggestions:
+    """Prefix indexes of the names and of the ingredients of the published recipes of this
+    process. They are updated in place when a recipe of this process is published,
+    unpublished, edited or deleted, and rebuilt every 'refresh' seconds to pick up the
+    writes of the other workers.
+
+    A build runs in a background thread while the previous indexes keep being served,
+    the writes made meanwhile are replayed on the new ones"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = None
+        self.names = None
+        self.ingredients = None
+        self.built_at = 0
+
+    def get(self, refresh):
+        """This method returns the (names, ingredients) indexes, or (None, None) until they are
+        first built. Missing or old indexes are (re)built in a background thread"""
+        with self._lock:
+            stale = self.names is None or time.monotonic() - self.built_at > refresh
+
+            if stale and self._pending is None:
+                self._pending = []
+                threading.Thread(target=self.rebuild, args=(current_app._get_current_object(), ), daemon=True).start()
+
+            return self.names, self.ingredients
+
+    def rebuild(self, app):
+        """This method builds new indexes and swaps them in, with the writes made during the build"""
+        try:
+            with app.app_context():
+                indexes = self.build()
+        except Exception:
+            app.logger.exception('Suggestion index build failed')
+            indexes = None
+
+        with self._lock:
+            if indexes is not None:
+                names, ingredients = indexes
+
+                for method, args in self._pending or ():
+                    getattr(self, method)(names, ingredients, *args)
+
+                self.names, self.ingredients = names, ingredients
+                self.built_at = time.monotonic()
+
+            self._pending = None
+
+    @staticmethod
+    def build():
+        """This method indexes the names and the parsed ingredients of every published recipe"""
+        from extensions import db
+        from models.ingredient import RecipeIngredient
+        from models.recipe import Recipe
+
+        names = db.session.query(Recipe.id, Recipe.name).filter(Recipe.is_publish.is_(True)).yield_per(10000)
+
+        ingredients = {}
+        rows = db.session.query(RecipeIngredient.recipe_id, RecipeIngredient.name).join(
+            Recipe, Recipe.id == RecipeIngredient.recipe_id).filter(Recipe.is_publish.is_(True)).yield_per(10000)
+
+        for row in rows:
+            ingredients.setdefault(row.recipe_id, []).append(row.name)
+
+        return (PrefixIndex.build((row.id, (row.name, )) for row in names),
+                PrefixIndex.build(ingredients.items()))
+
+    @staticmethod
+    def _publish(names, ingredients, recipe_id, name, recipe_ingredients):
+        from models.ingredient import parse_ingredients
+
+        names.add(recipe_id, (name, ))
+        ingredients.add(recipe_id, parse_ingredients(recipe_ingredients))
+
+    @staticmethod
+    def _unpublish(names, ingredients, recipe_id):
+        names.remove(recipe_id)
+        ingredients.remove(recipe_id)
+
+    def _apply(self, method, *args):
+        """Apply a write to the indexes, and keep it for the indexes being built"""
+        with self._lock:
+            if self.names is not None:
+                getattr(self, method)(self.names, self.ingredients, *args)
+
+            if self._pending is not None:
+                self._pending.append((method, args))
+
+    def publish(self, recipe_id, name, ingredients):
+        """This method adds a published recipe, when the indexes are built"""
+        self._apply('_publish', recipe_id, name, ingredients)
+
+    def unpublish(self, recipe_id):
+        """This method removes an unpublished or deleted recipe, when the indexes are built"""
+        self._apply('_unpublish', recipe_id)
+
+
+recipe_suggestions = RecipeSuggestions()
@@ -0,0 +1,87 @@
+# transactions.py file
+"""One database transaction per request.
+
+UnitOfWork.init_app() opens a unit of work before every request. Inside it,
+commit() only flushes the session, so the ids and the server defaults are
+there, and the transaction is committed once, after the view returned a
+response under 400 (it is rolled back otherwise). The side effects of the
+writes (cache invalidation, in-memory indexes, files) are registered with
+after_commit() and run only once the transaction is committed.
+
+Outside of a request, in the commands, the background threads and the cache
+warm-up, commit() commits right away and after_commit() runs its function.
+"""
+
+# Import the necessary package and module
+from flask import current_app, g, has_request_context
+
+
+def in_unit_of_work():
+    """Function to know if the current request has an open unit of work"""
+    return has_request_context() and 'unit_of_work' in g
+
+
+def commit():
+    """Function to commit the session, at the end of the request inside a unit of work"""
+    # extensions.py creates the UnitOfWork instance, db is imported on use
+    from extensions import db
+
+    if in_unit_of_work():
+        db.session.flush()
+        g.unit_of_work_pending = True
+    else:
+        db.session.commit()
+
+
+def after_commit(function, *args, **kwargs):
+    """Function to run a side effect of a write once the transaction is committed"""
+    if in_unit_of_work():
+        g.unit_of_work.append((function, args, kwargs))
+    else:
+        function(*args, **kwargs)
+
+
+class UnitOfWork:
+    """Commit the session once per request"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """This method registers the request hooks. Register it after the other extensions
+        with an after_request hook, so that it runs before them and they see the commit"""
+        app.before_request(self._begin)
+        app.after_request(self._finish)
+        app.extensions['unit_of_work'] = self
+
+    @staticmethod
+    def _begin():
+        """Open the unit of work of the request"""
+        g.unit_of_work = []
+        g.unit_of_work_pending = False
+
+    @staticmethod
+    def _finish(response):
+        """Commit or roll back the writes of the request, then run their side effects"""
+        from extensions import db
+
+        callbacks = g.pop('unit_of_work', [])
+
+        if response.status_code >= 400:
+            if g.pop('unit_of_work_pending', False):
+                db.session.rollback()
+
+            return response
+
+        # A failed commit raises here, the client gets a 500 instead of the response
+        if g.pop('unit_of_work_pending', False):
+            db.session.commit()
+
+        for function, args, kwargs in callbacks:
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                current_app.logger.exception('Side effect of a committed request failed')
+
+        return response
@@ -1,65 +1,193 @@
 # utils.py file
 
 # Import the necessary package and module
-from passlib.hash import pbkdf2_sha256
 from itsdangerous import URLSafeTimedSerializer
-from flask import current_app
+from flask import current_app, request
 
+import hashlib
 import os
+import threading
 import uuid
-from PIL import Image
+from datetime import datetime
 
 from flask_uploads import extension
+from caching import warmer
 from extensions import image_set, cache
+from metrics import timed
+
+
+def preload_modules():
+    """Function to import the heavy modules that are otherwise loaded on first use.
+
+    Called in the Gunicorn master when the app is preloaded, so the workers
+    share them copy-on-write instead of importing them on their first request"""
+    from passlib.hash import pbkdf2_sha256
+    from PIL import Image
+    import numpy
+    import requests
+
+    # Load the Pillow plugins and the passlib backend now rather than in each worker
+    Image.init()
+    pbkdf2_sha256.hash('preload')
 
 
 def hash_password(password):
     """Function for hashing password"""
+    # passlib is imported on first use, to keep the boot of the workers fast
+    from passlib.hash import pbkdf2_sha256
+
     return pbkdf2_sha256.hash(password)
 
 
 def check_password(password, hashed):
     """Function for user authentication"""
+    from passlib.hash import pbkdf2_sha256
+
     return pbkdf2_sha256.verify(password, hashed)
 
 
+def get_serializer():
+    """Function to get the token serializer of the app, built once from its SECRET_KEY"""
+    extensions = current_app.extensions
+    serializer = extensions.get('token_serializer')
+
+    if serializer is None:
+        serializer = extensions['token_serializer'] = URLSafeTimedSerializer(current_app.config.get('SECRET_KEY'))
+
+    return serializer
+
+
 def generate_token(email, salt=None):
     """Function to create a token via email"""
-    serializer = URLSafeTimedSerializer(current_app.config.get('SECRET_KEY'))
-    return serializer.dumps(email, salt=salt)
+    return get_serializer().dumps(email, salt=salt)
 
 
 def verify_token(token, max_age=(30 * 60), salt=None):
     """Function to extract the email address from the token."""
-    serializer = URLSafeTimedSerializer(current_app.config.get('SECRET_KEY'))
-
     try:
-        email = serializer.loads(token, max_age=max_age, salt=salt)
+        email = get_serializer().loads(token, max_age=max_age, salt=salt)
     except:
         return False
 
     return email
 
 
+def used_token_key(token):
+    """Function to get the cache key marking a single-use token as consumed"""
+    return 'token:used:{}'.format(hashlib.sha256(token.encode()).hexdigest())
+
+
+def is_token_used(token):
+    """Function to know if a single-use token was already consumed, without a database query"""
+    return cache.get(used_token_key(token)) is not None
+
+
+def mark_token_used(token, max_age=(30 * 60)):
+    """Function to remember a consumed single-use token until it expires anyway"""
+    cache.set(used_token_key(token), 1, timeout=max_age)
+
+
+# First bytes of the image formats accepted on upload, with the format name given by Pillow
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+)
+
+
+def upload_too_large(max_size):
+    """Function to know, from the Content-Length header, if the body of the request is over
+    max_size bytes, before the body is read"""
+    return request.content_length is not None and request.content_length > max_size
+
+
+def validate_image(file):
+    """Function to check an uploaded image from its first bytes and its header, without
+    decoding it. Returns the error message, or None when the image is valid"""
+    # Pillow is imported on first use, to keep the boot of the workers fast
+    from PIL import Image
+
+    stream = file.stream
+
+    with timed('image'):
+        head = stream.read(16)
+        stream.seek(0)
+
+        image_format = next((name for signature, name in IMAGE_SIGNATURES if head.startswith(signature)), None)
+
+        if image_format is None:
+            return 'Not a valid image'
+
+        # Image.open() only reads the header, the pixels are decoded later by compress_image()
+        try:
+            image = Image.open(stream)
+            width, height = image.size
+        except (IOError, SyntaxError, ValueError, Image.DecompressionBombError):
+            return 'Not a valid image'
+        finally:
+            stream.seek(0)
+
+    if image.format != image_format:
+        return 'Not a valid image'
+
+    if width * height > current_app.config['UPLOAD_MAX_IMAGE_PIXELS']:
+        return 'Image must not be larger than {} pixels'.format(current_app.config['UPLOAD_MAX_IMAGE_PIXELS'])
+
+    return None
+
+
 def save_image(image, folder):
     """Function to generate the filename for the uploaded image"""
     filename = '{}.{}'.format(uuid.uuid4(), extension(image.filename))
-    image_set.save(image, folder=folder, name=filename)
 
-    # We invoke the compress_image function and then it's stored within the
-    # filename variable
-    filename = compress_image(filename=filename, folder=folder)
+    # The time spent here is reported as the 'image' phase of the request
+    with timed('image'):
+        image_set.save(image, folder=folder, name=filename)
+
+        # We invoke the compress_image function and then it's stored within the
+        # filename variable
+        filename = compress_image(filename=filename, folder=folder)
 
     return filename
 
 
+def remove_image(folder, filename):
+    """Function to remove an image that is replaced or not used"""
+    path = image_set.path(filename=filename, folder=folder)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def remove_image_later(folder, filename, delay):
+    """Function to remove an image after delay seconds, when the cached responses still link to it.
+    An image left by a restart of the worker is only a file that nothing links to"""
+    path = image_set.path(filename=filename, folder=folder)
+
+    def remove():
+        if os.path.exists(path):
+            os.remove(path)
+
+    timer = threading.Timer(delay, remove)
+    timer.daemon = True
+    timer.start()
+
+
 def compress_image(filename, folder):
     """Function to compress image"""
+    # Pillow is imported on first use, to keep the boot of the workers fast
+    from PIL import Image
+
     file_path = image_set.path(filename=filename, folder=folder)
 
     # Create the image object from the image file.
     image = Image.open(file_path)
 
+    # A JPEG is decoded straight at the smallest scale still over 800 px, instead of at full size
+    image.draft('RGB', (800, 800))
+
     # Check the color mode of the image and then convert the image
     # to the 'RGB' color mode
     if image.mode != 'RGB':
@@ -84,7 +212,8 @@ def compress_image(filename, folder):
     compressed_size = os.stat(compressed_file_path).st_size
     percentage = round((original_size - compressed_size) / original_size * 100)
 
-    print(f'The file size is reduced by {percentage}%, from {original_size} to {compressed_size}')
+    current_app.logger.info(
+        'The file size is reduced by %s%%, from %s to %s', percentage, original_size, compressed_size)
 
     # Remove original image, return the compressed image
     os.remove(file_path)
@@ -94,4 +223,46 @@ def compress_image(filename, folder):
 def clear_cache(key_prefix):
     """Function to clear the cache with a specific prefix"""
     keys = [key for key in cache.cache._cache.keys() if key.startswith(key_prefix)]
-    cache.delete_many(*keys)
\ No newline at end of file
+    cache.delete_many(*keys)
+
+    # Recompute the most requested pages in the background, so the next requests
+    # do not all miss together and pile onto the database. The invalidations of
+    # the next CACHE_WARM_DELAY seconds share the same warm-up
+    if current_app.config.get('CACHE_WARM_ON_INVALIDATE'):
+        warmer.schedule(current_app._get_current_object(), key_prefix, delay=current_app.config['CACHE_WARM_DELAY'])
+
+
+# Format of the timestamp used as the version of a resource in its ETag
+ETAG_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def make_etag(updated_at):
+    """Function to build the ETag of a resource from its updated_at timestamp"""
+    return '"{}"'.format(updated_at.strftime(ETAG_FORMAT))
+
+
+def parse_etag(value):
+    """Function to get back the updated_at timestamp of an ETag, None if it is not valid"""
+    value = value.strip()
+
+    if value.startswith('W/'):
+        value = value[2:]
+
+    try:
+        return datetime.strptime(value.strip('"'), ETAG_FORMAT)
+    except ValueError:
+        return None
+
+
+def make_cursor(changed_at, kind, item_id):
+    """Function to build the opaque cursor of the change feed from its last change"""
+    return '{}.{}.{}'.format(changed_at.strftime(ETAG_FORMAT), kind, item_id)
+
+
+def parse_cursor(value):
+    """Function to get back the (changed_at, kind, id) of a cursor, None if it is not valid"""
+    try:
+        changed_at, kind, item_id = value.split('.')
+        return datetime.strptime(changed_at, ETAG_FORMAT), int(kind), int(item_id)
+    except ValueError:
+        return None